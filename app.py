@@ -1,17 +1,59 @@
 from flask import Flask, request, render_template, send_file, redirect, url_for, session, jsonify, make_response
 from flask_cors import CORS
+from flask_socketio import SocketIO, join_room, emit
 import os
-import pandas as pd
-from itertools import combinations
+import importlib
+from itertools import combinations, chain, islice
 import tempfile
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+import hashlib
+import multiprocessing
+import zlib
+import zipfile
+import threading
+import time
+import uuid
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import OrderedDict
+from functools import partial
+from contextlib import contextmanager
 from urllib.parse import quote
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.utils import safe_join
 import logging
+import click
 import mimetypes
 import re
-from openpyxl.utils import get_column_letter
+import fcntl
 import traceback  # トレースバック情報の取得用
-from openpyxl.styles import Font, PatternFill
+
+
+class LazyModule:
+    """最初に属性を参照したときに import するモジュール
+
+    pandas・scipy・openpyxl などは読み込みに時間がかかるため、起動時には読み込まず、
+    それを使う処理が最初に実行されたときに読み込む（CLI の --help やページ表示だけなら読み込まない）。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+sparse = LazyModule('scipy.sparse')
+pa = LazyModule('pyarrow')
+zstandard = LazyModule('zstandard')
+chardet = LazyModule('chardet')
+openpyxl = LazyModule('openpyxl')
 
 
 # CSPを設定するデコレータ
@@ -42,6 +84,13 @@ CORS(app, resources={
     }
 }) # credentials サポートを追加
 
+# 進捗通知用の Socket.IO（ワーカースレッドから emit するため threading モード）
+socketio = SocketIO(
+    app,
+    async_mode='threading',
+    cors_allowed_origins=["http://localhost:5000", "http://127.0.0.1:5000"]
+)
+
 # セッションの設定
 app.config.update(
     SECRET_KEY=os.urandom(24),
@@ -51,20 +100,54 @@ app.config.update(
 )
 app.secret_key = os.environ.get("SECRET_KEY", os.urandom(24))
 
-# 一時ディレクトリの設定
-UPLOAD_FOLDER = tempfile.mkdtemp()
-OUTPUT_FOLDER = tempfile.mkdtemp()
+# 成果物（アップロード・出力・ジョブ情報）の保存先
+# 複数のワーカープロセス（gunicorn など）で共有するため、プロセスごとの一時ディレクトリではなく
+# ARTIFACT_FOLDER 配下の固定のディレクトリを使う。古いものは ArtifactCollector が削除する。
+ARTIFACT_FOLDER = os.environ.get(
+    "ARTIFACT_FOLDER", os.path.join(tempfile.gettempdir(), 'co_occurrence_artifacts')
+)
+UPLOAD_FOLDER = os.path.join(ARTIFACT_FOLDER, 'uploads')
+OUTPUT_FOLDER = os.path.join(ARTIFACT_FOLDER, 'outputs')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 app.config.update(
+    ARTIFACT_FOLDER=ARTIFACT_FOLDER,
     UPLOAD_FOLDER=UPLOAD_FOLDER,
     OUTPUT_FOLDER=OUTPUT_FOLDER,
-    MAX_CONTENT_LENGTH=32 * 1024 * 1024,  # 32MB
+    ARTIFACT_TTL_SECONDS=int(os.environ.get("ARTIFACT_TTL_SECONDS", 24 * 60 * 60)),  # 成果物の保持期間（24時間）
+    ARTIFACT_MAX_BYTES=int(os.environ.get("ARTIFACT_MAX_BYTES", 10 * 1024 * 1024 * 1024)),  # 成果物の上限（10GB）
+    ARTIFACT_GC_INTERVAL_SECONDS=int(os.environ.get("ARTIFACT_GC_INTERVAL_SECONDS", 10 * 60)),  # 削除処理の間隔
+    MAX_CONTENT_LENGTH=4 * 1024 * 1024 * 1024,  # 4GB
+    STREAMING_THRESHOLD_BYTES=256 * 1024 * 1024,  # これ以上のCSVはチャンクごとに読み込む
+    COOCCURRENCE_WORKERS=int(os.environ.get("COOCCURRENCE_WORKERS", 1)),  # 共起回数計算のプロセス数
+    RESULT_CACHE_MAX_BYTES=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024)),  # 結果キャッシュの上限（1GB）
+    CAMPAIGN_MEMO_PATH=os.environ.get(
+        "CAMPAIGN_MEMO_PATH", os.path.join(tempfile.gettempdir(), 'co_occurrence_campaign_memo.json')
+    ),  # キャンペーン名クリーニング結果のメモ
+    STATE_FOLDER=os.environ.get(
+        "STATE_FOLDER", os.path.join(tempfile.gettempdir(), 'co_occurrence_states')
+    ),  # 差分更新用の共起状態
+    UPLOAD_CHUNK_BYTES=8 * 1024 * 1024,  # 分割アップロードの既定のチャンクサイズ
+    MAX_UPLOAD_CHUNK_BYTES=64 * 1024 * 1024,  # 1チャンクの上限
+    MAX_UPLOAD_BYTES=int(os.environ.get("MAX_UPLOAD_BYTES", 4 * 1024 * 1024 * 1024)),  # 分割アップロード1件の上限（4GB）
     TEMPLATES_AUTO_RELOAD=True
 )
 
 ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
+# ダウンロード時の出力形式ごとのMIMEタイプ
+OUTPUT_MIMETYPES = {
+    'csv': 'text/csv;charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+    'npz': 'application/octet-stream',
+    'json': 'application/json'
+}
+# 圧縮済みの形式（xlsx は zip、parquet は列ごとに圧縮済み）はダウンロード時に再圧縮しない
+PRECOMPRESSED_EXTENSIONS = {'xlsx', 'parquet'}
+# ダウンロードを圧縮・zip 化するときに一度に読む大きさ
+DOWNLOAD_BLOCK_BYTES = 1024 * 1024
 executor = ThreadPoolExecutor(max_workers=4)
 
 # Flaskアプリケーションで、より緩和されたCSP設定を適用
@@ -91,66 +174,234 @@ def sanitize_filename(filename):
     clean_name = clean_name.strip()
     return clean_name
 
+# キャンペーン名の先頭から削除する数字・空白・全角/半角スラッシュ
+# （従来の r'^\d+[/／]', r'^\d+\s*[/／]', r'^[\d\s/／]+', r'^[/／]+', r'^\d+[/／]\d+[/／]' の
+#   順次適用は、いずれもこの文字集合の接頭辞を削るだけなので1つのパターンにまとめられる）
+CAMPAIGN_PREFIX_PATTERN = re.compile(r'^[\d\s/／]+')
+
 def clean_campaign_name(campaign_name):
     """キャンペーン名から先頭の数字と全角/半角スラッシュを削除"""
     if pd.isna(campaign_name):
         return campaign_name
     
-    campaign_name = str(campaign_name)
-    patterns = [
-        r'^\d+[/／]',
-        r'^\d+\s*[/／]',
-        r'^[\d\s/／]+',
-        r'^[/／]+',
-        r'^\d+[/／]\d+[/／]',
-    ]
-    
-    cleaned = campaign_name
-    for pattern in patterns:
-        cleaned = re.sub(pattern, '', cleaned)
-    
-    cleaned = re.sub(r'^[/／]+', '', cleaned)
-    cleaned = cleaned.strip()
-    
-    return cleaned
+    return CAMPAIGN_PREFIX_PATTERN.sub('', str(campaign_name)).strip()
+
+# キャンペーン名のメモ（元の名前 -> クリーニング後の名前）
+# アップロードをまたいで再利用するため CAMPAIGN_MEMO_PATH に保存し、初回使用時に読み込む
+campaign_memo = None
+campaign_memo_lock = threading.Lock()
+
+def load_campaign_memo():
+    """保存済みのメモを読み込む（クリーニング規則が変わっていれば破棄する）"""
+    try:
+        with open(app.config['CAMPAIGN_MEMO_PATH'], encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('pattern') == CAMPAIGN_PREFIX_PATTERN.pattern:
+            return data['names']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_campaign_memo():
+    """メモを一時ファイル経由で原子的に保存する（campaign_memo_lock を保持して呼ぶ）"""
+    path = app.config['CAMPAIGN_MEMO_PATH']
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pattern': CAMPAIGN_PREFIX_PATTERN.pattern, 'names': campaign_memo}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"キャンペーン名メモの保存に失敗: {str(e)}")
+
+def lookup_cleaned_names(values):
+    """欠損でない値のクリーニング後の名前をメモから引き、未登録の値だけをまとめてクリーニングする"""
+    global campaign_memo
+    keys = [str(value) for value in values]
+    with campaign_memo_lock:
+        if campaign_memo is None:
+            campaign_memo = load_campaign_memo()
+        missing = [key for key in dict.fromkeys(keys) if key not in campaign_memo]
+
+    if missing:
+        cleaned = (
+            pd.Series(missing, dtype=object)
+            .str.replace(CAMPAIGN_PREFIX_PATTERN, '', regex=True)
+            .str.strip()
+        )
+        with campaign_memo_lock:
+            campaign_memo.update(zip(missing, cleaned))
+            save_campaign_memo()
+        logger.info(f"キャンペーン名メモに{len(missing)}件を追加（合計{len(campaign_memo)}件）")
+
+    with campaign_memo_lock:
+        return np.array([campaign_memo[key] for key in keys], dtype=object)
+
+def clean_campaign_names(campaigns):
+    """キャンペーン名の列をまとめてクリーニングする（clean_campaign_name のベクトル版）
+
+    ユニークな値だけをメモと .str アクセサでクリーニングし、整数コードで元の行に戻す。
+    欠損値はそのまま残す。
+    """
+    codes, uniques = pd.factorize(campaigns)
+    cleaned = lookup_cleaned_names(uniques)
+    result = campaigns.to_numpy(dtype=object).copy()
+    mask = codes >= 0
+    result[mask] = cleaned[codes[mask]]
+    return pd.Series(result, index=campaigns.index, name=campaigns.name)
+
+# 検索するカラム名のパターン
+ID_PATTERNS = ['id', 'ID', '担当者', '見込客']
+CAMPAIGN_PATTERNS = ['キャンペーン', 'campaign', 'CAMPAIGN']
+
+# ヘッダー行を探索する先頭行数
+HEADER_SEARCH_ROWS = 20
+# ヘッダー探索で読み込むバイト数の上限
+HEADER_SNIFF_MAX_BYTES = 1024 * 1024
+# chardet に渡すサンプルのバイト数
+CHARDET_SAMPLE_BYTES = 64 * 1024
+
+# 試行するエンコーディング（chardet の推定結果があれば先頭に置く）
+# cp932 は Shift_JIS の上位互換で、①・㈱・Ⅱ などの NEC 特殊文字も読めるため shift-jis は試さない
+CSV_ENCODINGS = ['utf-8', 'cp932']
+# chardet の推定結果のうち採用するものと、その読み替え
+CHARDET_ENCODING_ALIASES = {
+    'ascii': 'utf-8',
+    'utf-8': 'utf-8',
+    'utf-8-sig': 'utf-8-sig',
+    'shift_jis': 'cp932',
+    'cp932': 'cp932',
+    'euc-jp': 'euc-jp',
+}
+# 区切り文字の候補
+CSV_DELIMITERS = ',\t;|'
+
+def read_csv_prefix(filepath, max_rows=HEADER_SEARCH_ROWS, max_bytes=HEADER_SNIFF_MAX_BYTES):
+    """CSVファイルの先頭から空行を除いて max_rows 行分の生バイトを読み込む"""
+    lines = []
+    non_blank = 0
+    size = 0
+    with open(filepath, 'rb') as f:
+        while non_blank < max_rows and size < max_bytes:
+            line = f.readline(max_bytes - size)
+            if not line:
+                break
+            lines.append(line)
+            size += len(line)
+            if line.strip():
+                non_blank += 1
+    return b''.join(lines)
+
+def candidate_encodings(sample):
+    """chardet の推定結果を先頭に、試行するエンコーディングの順序を決める"""
+    detected = chardet.detect(sample[:CHARDET_SAMPLE_BYTES]).get('encoding')
+    detected = CHARDET_ENCODING_ALIASES.get((detected or '').lower())
+    if not detected:
+        return list(CSV_ENCODINGS)
+    return [detected] + [e for e in CSV_ENCODINGS if e != detected]
+
+def candidate_delimiters(text):
+    """csv.Sniffer で推定した区切り文字を先頭に、試行する区切り文字の順序を決める"""
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return [',']
+    return [delimiter] if delimiter == ',' else [delimiter, ',']
+
+def sniff_csv_header_rows(text, delimiter):
+    """デコード済みの先頭部分からヘッダー候補の行番号を返す
+
+    行番号は pandas の header 引数と同じく空行を除いて数える。
+    """
+    candidates = []
+    row_index = 0
+    for row in csv.reader(io.StringIO(text), delimiter=delimiter):
+        # pandas と同様に空行・空白のみの行は数えない
+        if not row or (len(row) == 1 and not row[0].strip()):
+            continue
+        if row_index >= HEADER_SEARCH_ROWS:
+            break
+        if check_header_values(row, ID_PATTERNS, CAMPAIGN_PATTERNS):
+            candidates.append(row_index)
+        row_index += 1
+    return candidates, row_index
+
+def sniff_parse_plans(filepath, file_ext):
+    """ファイルの先頭部分だけを読み、パースプランの候補を優先順に返す
+
+    パースプランは読み込みに必要なエンコーディング・区切り文字・ヘッダー行
+    （xlsx の場合はシート名とヘッダー行）をまとめた辞書。
+    """
+    if file_ext == 'xlsx':
+        # 最初のシートの先頭20行だけを read_only モードで読み込んでヘッダー候補を探す
+        workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            worksheet = workbook.worksheets[0]
+            sheet_name = worksheet.title
+            preview = list(islice(worksheet.iter_rows(values_only=True), HEADER_SEARCH_ROWS))
+        finally:
+            workbook.close()
+        candidates = [
+            i for i, values in enumerate(preview)
+            if check_header_values(values, ID_PATTERNS, CAMPAIGN_PATTERNS)
+        ]
+        logger.info(f"ヘッダー探索: 先頭{len(preview)}行を走査, 候補行: {candidates}")
+        return [
+            {'sheet_name': sheet_name, 'encoding': None, 'delimiter': None, 'header_row': i}
+            for i in candidates
+        ]
+
+    prefix = read_csv_prefix(filepath)
+    plans = []
+    for encoding in candidate_encodings(prefix):
+        try:
+            text = prefix.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        for delimiter in candidate_delimiters(text):
+            candidates, rows_scanned = sniff_csv_header_rows(text, delimiter)
+            logger.info(
+                f"ヘッダー探索 ({encoding}, {delimiter!r}): 先頭{len(prefix)}バイト/{rows_scanned}行を走査, "
+                f"候補行: {candidates}"
+            )
+            plans.extend(
+                {'sheet_name': None, 'encoding': encoding, 'delimiter': delimiter, 'header_row': i}
+                for i in candidates
+            )
+    return plans
+
+def read_with_parse_plan(filepath, plan, nrows=None):
+    """パースプランに従ってファイルを読み込む"""
+    if plan['sheet_name'] is not None:
+        return pd.read_excel(filepath, sheet_name=plan['sheet_name'], header=plan['header_row'], nrows=nrows)
+    return pd.read_csv(
+        filepath,
+        encoding=plan['encoding'],
+        sep=plan['delimiter'],
+        header=plan['header_row'],
+        nrows=nrows
+    )
 
 def find_header_row(filepath, file_ext):
-    """データフレームからヘッダー行を特定する（改善版）"""
-    # 検索するカラム名のパターン
-    id_patterns = ['id', 'ID', '担当者', '見込客']
-    campaign_patterns = ['キャンペーン', 'campaign', 'CAMPAIGN']
-    
+    """データフレームからヘッダー行を特定する（先頭行のみを走査し、本読み込みは1回）"""
+    plan, df = find_parse_plan(filepath, file_ext)
+    return plan['header_row'], df
+
+def find_parse_plan(filepath, file_ext):
+    """ファイル全体を読み込めたパースプランと DataFrame を返す（find_header_row の本体）"""
     try:
-        # ファイルの読み込み方法を決定
-        if file_ext == 'xlsx':
-            # Excelファイルの場合、シート名を取得
-            xls = pd.ExcelFile(filepath)
-            sheet_name = xls.sheet_names[0]  # 最初のシートを使用
-            
-            # 最初の数行を読み込んでヘッダーを確認
-            for i in range(20):  # 最初の20行をチェック
-                try:
-                    df = pd.read_excel(filepath, sheet_name=sheet_name, header=i)
-                    if check_columns(df, id_patterns, campaign_patterns):
-                        return i, df
-                except Exception as e:
-                    continue
-        else:
-            # CSVファイルの場合、エンコーディングを試行
-            encodings = ['utf-8', 'shift-jis', 'cp932']
-            
-            for encoding in encodings:
-                try:
-                    # 最初の数行を読み込んでヘッダーを確認
-                    for i in range(20):  # 最初の20行をチェック
-                        try:
-                            df = pd.read_csv(filepath, encoding=encoding, header=i)
-                            if check_columns(df, id_patterns, campaign_patterns):
-                                return i, df
-                        except Exception as e:
-                            continue
-                except Exception as e:
-                    continue
+        failed_encodings = set()
+        for plan in sniff_parse_plans(filepath, file_ext):
+            if plan['encoding'] in failed_encodings:
+                continue
+            try:
+                df = read_with_parse_plan(filepath, plan)
+                if check_columns(df, ID_PATTERNS, CAMPAIGN_PATTERNS):
+                    return plan, df
+            except UnicodeDecodeError:
+                # 先頭以降にデコードできない文字がある場合は次のエンコーディングへ
+                failed_encodings.add(plan['encoding'])
+            except Exception as e:
+                continue
                     
         # ヘッダーが見つからない場合
         raise ValueError("必要な列が見つかりませんでした。")
@@ -159,180 +410,2405 @@ def find_header_row(filepath, file_ext):
         logger.error(f"ファイル読み込みエラー: {str(e)}")
         raise
 
+def detect_parse_plan(filepath, file_ext, exclude_encodings=()):
+    """アップロード時に先頭部分だけでパースプランを決定する
+
+    ヘッダー行までを読み込んでID列・キャンペーン列を特定し、プランに含める。
+    exclude_encodings のエンコーディングは候補から除く（先頭以降でデコードに失敗した場合）。
+    """
+    for plan in sniff_parse_plans(filepath, file_ext):
+        if plan['encoding'] in exclude_encodings:
+            continue
+        try:
+            header = read_with_parse_plan(filepath, plan, nrows=0)
+            plan['id_column'], plan['campaign_column'] = get_column_names(header)
+            # 区切り文字の推定を誤ると1つの列が両方に一致するため除外する
+            if plan['id_column'] != plan['campaign_column']:
+                return plan
+        except Exception as e:
+            continue
+    raise ValueError("必要な列が見つかりませんでした。")
+
+def parse_plan_path(filepath):
+    """アップロードファイルに対応するパースプランのパス"""
+    return f"{filepath}.plan.json"
+
+def save_parse_plan(filepath, plan):
+    """パースプランをアップロードファイルの隣に保存する"""
+    with open(parse_plan_path(filepath), 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False)
+
+def load_parse_plan(filepath):
+    """保存済みのパースプランを読み込む（なければ None）"""
+    try:
+        with open(parse_plan_path(filepath), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_input_file(filepath, file_ext, progress=None):
+    """アップロード済みファイルを読み込む
+
+    パースプランが保存されていれば検出を省略して1回だけ読み込み、
+    使えない場合はヘッダー行の検出にフォールバックする。
+    戻り値は (ヘッダー行, DataFrame, パースプラン or None)。
+    """
+    plan = load_parse_plan(filepath)
+    if plan:
+        if progress:
+            progress('header_detected', header_row=plan['header_row'])
+        try:
+            df = read_with_parse_plan(filepath, plan)
+            if not df.empty and {plan['id_column'], plan['campaign_column']} <= set(df.columns):
+                return plan['header_row'], df, plan
+        except Exception as e:
+            logger.warning(f"パースプランでの読み込みに失敗したため再検出します: {str(e)}")
+
+    detected, df = find_parse_plan(filepath, file_ext)
+    if progress:
+        progress('header_detected', header_row=detected['header_row'])
+    if plan:
+        # 保存済みのプランを読み込めたエンコーディング・区切り文字のプランに置き換え、
+        # 次回以降の処理で失敗する読み込みを繰り返さない
+        try:
+            detected['id_column'], detected['campaign_column'] = get_column_names(df)
+        except ValueError:
+            return detected['header_row'], df, None
+        save_parse_plan(filepath, detected)
+        return detected['header_row'], df, detected
+    return detected['header_row'], df, None
+
+def store_parse_plan(filepath, filename):
+    """アップロード直後にパースプランを検出して保存する
+
+    検出に失敗してもアップロードは成功させ、処理時の検出に任せる。
+    """
+    plan_path = parse_plan_path(filepath)
+    try:
+        plan = detect_parse_plan(filepath, filename.rsplit('.', 1)[1].lower())
+        save_parse_plan(filepath, plan)
+        logger.info(f"パースプランを保存: {filename} -> {plan}")
+    except Exception as e:
+        # 同名ファイルの古いプランが残らないようにする
+        if os.path.exists(plan_path):
+            os.remove(plan_path)
+        logger.warning(f"パースプランの検出に失敗: {filename}: {str(e)}")
+
+def check_header_values(values, id_patterns, campaign_patterns):
+    """ヘッダー候補の値にID列とキャンペーン列が含まれているかをチェック"""
+    # 値を正規化（空白を削除し、小文字に変換）
+    columns = [str(value).strip().lower() for value in values if not pd.isna(value)]
+    
+    # ID列とキャンペーン列の存在確認
+    has_id = any(any(pattern.lower() in col for pattern in id_patterns) for col in columns)
+    has_campaign = any(any(pattern.lower() in col for pattern in campaign_patterns) for col in columns)
+    
+    return has_id and has_campaign
+
 def check_columns(df, id_patterns, campaign_patterns):
     """データフレームのカラムをチェック"""
     if df.empty or len(df.columns) == 0:
         return False
         
-    # カラム名を正規化（空白を削除し、小文字に変換）
-    columns = [str(col).strip().lower() for col in df.columns]
+    return check_header_values(df.columns, id_patterns, campaign_patterns)
+
+def get_column_names(df):
+    """必要なカラム名を特定する（改善版）"""
+    id_column = None
+    campaign_column = None
     
-    # ID列とキャンペーン列の存在確認
-    has_id = any(any(pattern.lower() in col for pattern in id_patterns) for col in columns)
-    has_campaign = any(any(pattern.lower() in col for pattern in campaign_patterns) for col in columns)
+    # カラム名を走査
+    for col in df.columns:
+        col_str = str(col).strip().lower()
+        
+        # ID列の検索
+        if not id_column and any(pattern.lower() in col_str for pattern in ID_PATTERNS):
+            id_column = col
+            
+        # キャンペーン列の検索
+        if not campaign_column and any(pattern.lower() in col_str for pattern in CAMPAIGN_PATTERNS):
+            campaign_column = col
+            
+        # 両方見つかった場合は終了
+        if id_column and campaign_column:
+            break
+            
+    if not id_column or not campaign_column:
+        raise ValueError(f"必要なカラムが見つかりません。\n見つかったカラム: {', '.join(df.columns)}")
+        
+    return id_column, campaign_column
+
+# 共起回数の計算で一度に処理するIDの数（進捗通知の単位）
+COUNT_BLOCK_IDS = 100_000
+
+def effective_count_workers(n_ids, workers=1):
+    """実際に使うプロセス数（各シャードが COUNT_BLOCK_IDS 件以上のIDを持つように減らす）"""
+    return max(1, min(workers or 1, n_ids // COUNT_BLOCK_IDS))
+
+def build_cooccurrence_counts(ids, campaigns, progress=None, workers=1):
+    """ID×キャンペーンの接続行列から共起回数の疎行列を作成する
+
+    IDとキャンペーン名を整数コードに変換し、重複を除いた接続行列 X から
+    XᵀX を計算して対角成分を0にする。戻り値は
+    (共起回数のCSR行列, ソート済みキャンペーン名, キャンペーンごとのユニークID数, 全ID数)。
+    workers が2以上の場合はIDでシャードに分けて複数プロセスで計算する。
+    """
+    # ラベルの並びは従来通り sorted(unique()) に合わせる（欠損値はラベルにしない）
+    unique_campaigns = sorted(campaigns.dropna().unique())
+
+    id_codes, id_uniques = pd.factorize(ids)
+    campaign_codes, campaign_uniques = pd.factorize(campaigns)
+    # factorize の出現順コードをソート済みラベルの位置に変換
+    campaign_codes = np.where(
+        campaign_codes >= 0,
+        pd.Index(unique_campaigns).get_indexer(campaign_uniques)[campaign_codes],
+        -1
+    )
+
+    # IDまたはキャンペーン名が欠損している行は共起の対象外
+    mask = (id_codes >= 0) & (campaign_codes >= 0)
+    incidence = sparse.csr_matrix(
+        (np.ones(mask.sum(), dtype=np.int64), (id_codes[mask], campaign_codes[mask])),
+        shape=(len(id_uniques), len(unique_campaigns))
+    )
+    counts, support, total_ids = incidence_to_cooccurrence(incidence, progress, workers)
+    return counts, unique_campaigns, support, total_ids
+
+def partial_cooccurrence(incidence):
+    """接続行列の一部（IDのシャード）から XᵀX の部分和を計算する（プロセスプールで実行）"""
+    return (incidence.T @ incidence).tocsr()
+
+def incidence_to_cooccurrence(incidence, progress=None, workers=1):
+    """ID×キャンペーンの接続行列から XᵀX を計算し、(対角成分を0にした共起回数, 支持度, 全ID数) を返す
+
+    支持度は XᵀX の対角成分（キャンペーンごとのユニークID数）、全ID数は
+    いずれかのキャンペーンに含まれるIDの数で、関連度指標の計算に使う。
+
+    XᵀX はIDのブロックごとに加算し、progress があればブロックごとに進捗を通知する。
+    workers が2以上なら、IDコードを workers で割った余りでシャードに分け、
+    各シャードの部分行列を ProcessPoolExecutor で計算して合計する。
+    同じIDは必ず同じシャードに入るため、結果は1プロセスの場合と一致する。
+    """
+    # 同一ID・同一キャンペーンの重複行は1回として数える
+    incidence = incidence.tocsr()
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+
+    n_ids, n_campaigns = incidence.shape
+    counts = sparse.csr_matrix((n_campaigns, n_campaigns), dtype=np.int64)
+    workers = effective_count_workers(n_ids, workers)
+    if workers > 1:
+        # Socket.IO などのスレッドが動いているプロセスから fork するとロックを引き継いで
+        # 止まることがあるため、forkserver でワーカープロセスを作る
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver')) as pool:
+            futures = {
+                pool.submit(partial_cooccurrence, incidence[shard::workers]): len(range(shard, n_ids, workers))
+                for shard in range(workers)
+            }
+            groups_done = 0
+            for future in as_completed(futures):
+                counts = counts + future.result()
+                groups_done += futures[future]
+                if progress:
+                    progress('counting', groups_done=groups_done, groups_total=n_ids)
+    else:
+        for start in range(0, n_ids, COUNT_BLOCK_IDS):
+            block = incidence[start:start + COUNT_BLOCK_IDS]
+            counts = counts + partial_cooccurrence(block)
+            if progress:
+                progress('counting', groups_done=min(start + COUNT_BLOCK_IDS, n_ids), groups_total=n_ids)
+    support = counts.diagonal()
+    total_ids = int(np.count_nonzero(np.diff(incidence.indptr)))
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return counts, support, total_ids
+
+# ストリーミング読み込みで一度に読むCSVの行数
+STREAM_CHUNK_ROWS = 500_000
+
+class CooccurrenceAccumulator:
+    """チャンクごとの (ID, キャンペーン名) を整数コードの組として蓄積する
+
+    IDとキャンペーン名は出現順に整数コードへ変換し、重複を除いた組だけを保持するため、
+    メモリ使用量は行数ではなくIDとキャンペーンの種類数（とその組の数）で決まる。
+    text_labels が True ならキャンペーン名は文字列として読み込んだものとし、result で
+    全体を読み込んだ場合（pd.read_csv の型推論）と同じ型のラベルに戻してから並べる
+    （クリーニングも型を戻した後に行う）。
+    """
+
+    def __init__(self, clean_campaigns=False, text_labels=False):
+        self.clean_campaigns = clean_campaigns
+        self.text_labels = text_labels
+        self.campaigns_missing = False
+        self.id_codes = {}
+        self.campaign_codes = {}
+        self.rows = 0
+        self._pairs = []
+        self._buffered = 0
+        self._compacted = 0
+
+    def add(self, ids, campaigns):
+        """1チャンク分のID列・キャンペーン列（categorical）を取り込む"""
+        ids = ids.astype('category')
+        campaigns = campaigns.astype('category')
+        self.rows += len(ids)
+
+        # チャンク内のカテゴリを全体のコードに変換（キャンペーン名はIDが欠損していても登録する）
+        id_map = np.array(
+            [self.id_codes.setdefault(v, len(self.id_codes)) for v in ids.cat.categories],
+            dtype=np.int64
+        )
+        names = campaigns.cat.categories
+        if self.clean_campaigns and not self.text_labels:
+            # クリーニング後に同じ名前になるカテゴリは同じコードにまとめる
+            names = lookup_cleaned_names(names)
+        campaign_map = np.array(
+            [self.campaign_codes.setdefault(v, len(self.campaign_codes)) for v in names],
+            dtype=np.int64
+        )
+
+        id_idx = ids.cat.codes.to_numpy()
+        campaign_idx = campaigns.cat.codes.to_numpy()
+        self.campaigns_missing |= bool((campaign_idx < 0).any())
+        mask = (id_idx >= 0) & (campaign_idx >= 0)
+        keys = np.unique((id_map[id_idx[mask]] << 32) | campaign_map[campaign_idx[mask]])
+        self._pairs.append(keys)
+        self._buffered += len(keys)
+
+        # チャンクをまたいだ重複が溜まったら圧縮する
+        if self._buffered > 2 * max(self._compacted, len(keys)):
+            self._compact()
+
+    def _compact(self):
+        keys = np.unique(np.concatenate(self._pairs)) if self._pairs else np.empty(0, dtype=np.int64)
+        self._pairs = [keys]
+        self._buffered = self._compacted = len(keys)
+
+    def result(self, progress=None, workers=1):
+        """build_cooccurrence_counts と同じ (共起回数, キャンペーン名, 支持度, 全ID数) を返す"""
+        self._compact()
+        keys = self._pairs[0]
+
+        # 出現順のコードをソート済みラベルの位置に変換
+        # （型を戻したときに同じ値になるラベルは同じ位置にまとめ、重複した組は集計時に1回として数える）
+        labels = self.typed_labels()
+        unique_campaigns = sorted(set(labels))
+        position = np.empty(len(labels), dtype=np.int64)
+        position[list(self.campaign_codes.values())] = pd.Index(unique_campaigns).get_indexer(labels)
+
+        incidence = sparse.csr_matrix(
+            (np.ones(len(keys), dtype=np.int64), (keys >> 32, position[keys & 0xFFFFFFFF])),
+            shape=(len(self.id_codes), len(unique_campaigns))
+        )
+        counts, support, total_ids = incidence_to_cooccurrence(incidence, progress, workers)
+        return counts, unique_campaigns, support, total_ids
+
+    def typed_labels(self):
+        """登録順のキャンペーン名（text_labels なら全て数値に変換できる場合に数値に戻す）
+
+        pd.read_csv と同様に、全ての値が数値なら数値の列とし、欠損値があれば float にする。
+        clean_campaigns なら型を戻した値をクリーニングする（全体を読み込んだ場合と同じ名前になる）。
+        """
+        labels = list(self.campaign_codes)
+        if not self.text_labels or not labels:
+            return labels
+        try:
+            values = pd.to_numeric(pd.Series(labels, dtype=object))
+            if self.campaigns_missing:
+                values = values.astype(float)
+            labels = values.tolist()
+        except (ValueError, TypeError):
+            pass
+        if self.clean_campaigns:
+            labels = lookup_cleaned_names(labels).tolist()
+        return labels
+
+def header_positions(values):
+    """ヘッダー行の値から ID列・キャンペーン列の位置を返す（get_column_names と同じ規則）"""
+    id_position = None
+    campaign_position = None
+    for position, value in enumerate(values):
+        if value is None:
+            continue
+        col_str = str(value).strip().lower()
+        if id_position is None and any(pattern.lower() in col_str for pattern in ID_PATTERNS):
+            id_position = position
+        if campaign_position is None and any(pattern.lower() in col_str for pattern in CAMPAIGN_PATTERNS):
+            campaign_position = position
+    return id_position, campaign_position
+
+def iter_xlsx_chunks(filepath, progress=None, chunk_rows=STREAM_CHUNK_ROWS, as_text=False):
+    """xlsx を openpyxl の read_only モードで1回だけ開き、(ID列, キャンペーン列) をチャンクごとに返す
+
+    先頭20行からヘッダー行を特定し、以降の行は iter_rows(values_only=True) で
+    ID列とキャンペーン列の値だけを取り出す。as_text が True なら値を文字列にする
+    （CSVと突き合わせる場合に数値のIDと文字列のIDを同じものとして扱うため）。
+    """
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)  # 最初のシートを使用
+        preview = list(islice(rows, HEADER_SEARCH_ROWS))
+
+        header_row = next(
+            (i for i, values in enumerate(preview) if check_header_values(values, ID_PATTERNS, CAMPAIGN_PATTERNS)),
+            None
+        )
+        if header_row is None:
+            raise ValueError("必要な列が見つかりませんでした。")
+        id_position, campaign_position = header_positions(preview[header_row])
+        logger.info(f"ヘッダー探索: 先頭{len(preview)}行を走査, ヘッダー行: {header_row}")
+        if progress:
+            progress('header_detected', header_row=header_row)
+
+        def to_series(values):
+            if as_text:
+                values = [None if value is None else str(value) for value in values]
+            return pd.Series(values, dtype=object)
+
+        width = max(id_position, campaign_position) + 1
+        ids, campaigns = [], []
+        for values in chain(preview[header_row + 1:], rows):
+            if len(values) < width:
+                values = tuple(values) + (None,) * (width - len(values))
+            id_value, campaign_value = values[id_position], values[campaign_position]
+            # 空行は pandas と同様に末尾では除かれ、途中では欠損として共起の対象外になる
+            if id_value is None and campaign_value is None:
+                continue
+            ids.append(id_value)
+            campaigns.append(campaign_value)
+            if len(ids) >= chunk_rows:
+                yield to_series(ids), to_series(campaigns)
+                ids, campaigns = [], []
+        if ids:
+            yield to_series(ids), to_series(campaigns)
+    finally:
+        workbook.close()
+
+def stream_xlsx_cooccurrence_counts(filepath, progress=None, chunk_rows=STREAM_CHUNK_ROWS, workers=1,
+                                    clean_campaigns=False):
+    """xlsx を openpyxl の read_only モードで1回だけ開き、共起回数を作成する
+
+    iter_xlsx_chunks で取り出したID列とキャンペーン列の値だけを CooccurrenceAccumulator に渡す。
+    戻り値は build_cooccurrence_counts と同じ (共起回数, キャンペーン名, 支持度, 全ID数)。
+    """
+    accumulator = CooccurrenceAccumulator(clean_campaigns)
+    for ids, campaigns in iter_xlsx_chunks(filepath, progress, chunk_rows):
+        accumulator.add(ids, campaigns)
+        if progress:
+            progress('parsed', rows=accumulator.rows)
+
+    if accumulator.rows == 0:
+        raise ValueError("データ行がありません")
+    logger.info(
+        f"xlsx読み込み完了: {accumulator.rows}行, "
+        f"ID {len(accumulator.id_codes)}件, キャンペーン {len(accumulator.campaign_codes)}件"
+    )
+    return accumulator.result(progress, workers)
+
+def use_streaming(filepath, file_ext, streaming=None):
+    """ストリーミング読み込みを使うかどうか（未指定ならファイルサイズで判断）"""
+    if file_ext != 'csv':
+        return False
+    if streaming is not None:
+        return bool(streaming)
+    return os.path.getsize(filepath) >= app.config['STREAMING_THRESHOLD_BYTES']
+
+def iter_csv_chunks(filepath, file_ext, progress=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """CSVのID列とキャンペーン列だけを (ID列, キャンペーン列) のチャンクごとに返す（値は文字列のカテゴリ）"""
+    # チャンク読み込みには列名とエンコーディングが必要なため、プランがなければ先頭部分から検出する
+    plan = load_parse_plan(filepath) or detect_parse_plan(filepath, file_ext)
+    if progress:
+        progress('header_detected', header_row=plan['header_row'])
+
+    # 先頭部分だけで決めたエンコーディングは、それ以降の行でデコードに失敗することがある。
+    # その場合は別のエンコーディングで検出し直し、返し終えた行を読み飛ばして続きから返す
+    # （ASCII 互換のエンコーディングでは行の区切りは変わらない）。
+    failed_encodings = set()
+    rows_done = 0
+    while True:
+        id_column, campaign_column = plan['id_column'], plan['campaign_column']
+        skip = rows_done
+        try:
+            reader = pd.read_csv(
+                filepath,
+                encoding=plan['encoding'],
+                sep=plan['delimiter'],
+                header=plan['header_row'],
+                usecols=[id_column, campaign_column],
+                dtype={id_column: 'category', campaign_column: 'category'},
+                chunksize=chunk_rows
+            )
+            with reader:
+                for chunk in reader:
+                    if skip:
+                        chunk, skip = chunk.iloc[skip:], max(0, skip - len(chunk))
+                        if chunk.empty:
+                            continue
+                    rows_done += len(chunk)
+                    yield chunk[id_column], chunk[campaign_column]
+            return
+        except UnicodeDecodeError as e:
+            failed_encodings.add(plan['encoding'])
+            logger.warning(f"{plan['encoding']} でデコードできない行があるため再検出します: {str(e)}")
+            plan = detect_parse_plan(filepath, file_ext, exclude_encodings=failed_encodings)
+            # アップロード時に保存したプランがあれば置き換える（CLI の入力ファイルの隣には作らない）
+            if os.path.exists(parse_plan_path(filepath)):
+                save_parse_plan(filepath, plan)
+
+def stream_cooccurrence_counts(filepath, file_ext, progress=None, chunk_rows=STREAM_CHUNK_ROWS, workers=1,
+                               clean_campaigns=False):
+    """CSVをチャンクごとに読み込み、ID列とキャンペーン列だけから共起回数を作成する
+
+    戻り値は build_cooccurrence_counts と同じ (共起回数, キャンペーン名, 支持度, 全ID数)。
+    """
+    accumulator = CooccurrenceAccumulator(clean_campaigns, text_labels=True)
+    for ids, campaigns in iter_csv_chunks(filepath, file_ext, progress, chunk_rows):
+        accumulator.add(ids, campaigns)
+        if progress:
+            progress('parsed', rows=accumulator.rows)
+
+    if accumulator.rows == 0:
+        raise ValueError("データ行がありません")
+    logger.info(
+        f"ストリーミング読み込み完了: {accumulator.rows}行, "
+        f"ID {len(accumulator.id_codes)}件, キャンペーン {len(accumulator.campaign_codes)}件"
+    )
+    return accumulator.result(progress, workers)
+
+# 統合モードでファイルを並行して読み込むスレッド数の上限
+MERGE_PARSE_THREADS = 4
+
+def merged_cooccurrence_counts(filepaths, progress=None, chunk_rows=STREAM_CHUNK_ROWS, workers=1,
+                               clean_campaigns=False):
+    """複数のファイルを並行して読み込み、IDで統合した1つの共起回数を作成する
+
+    各ファイルはスレッドでID列とキャンペーン列だけをチャンクごとに読み、共有の
+    CooccurrenceAccumulator に (ID, キャンペーン) の組として加える。DataFrame を連結しないため、
+    メモリ使用量はファイルの行数ではなく重複を除いた組の数で決まる。
+    複数のファイルに現れる同じ (ID, キャンペーン) は1回として数え、異なるファイルの
+    キャンペーンも同じIDなら共起として数える。IDとキャンペーン名は文字列として照合する。
+    戻り値は build_cooccurrence_counts と同じ (共起回数, キャンペーン名, 支持度, 全ID数)。
+    """
+    accumulator = CooccurrenceAccumulator(clean_campaigns)
+    accumulator_lock = threading.Lock()
+
+    def ingest(filepath):
+        file_ext = filepath.rsplit('.', 1)[1].lower()
+        if file_ext == 'xlsx':
+            chunks = iter_xlsx_chunks(filepath, progress, chunk_rows, as_text=True)
+        else:
+            chunks = iter_csv_chunks(filepath, file_ext, progress, chunk_rows)
+        rows = 0
+        for ids, campaigns in chunks:
+            rows += len(ids)
+            with accumulator_lock:
+                accumulator.add(ids, campaigns)
+                if progress:
+                    progress('parsed', rows=accumulator.rows)
+        logger.info(f"統合読み込み: {os.path.basename(filepath)} {rows}行")
+        return rows
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(filepaths), MERGE_PARSE_THREADS))) as pool:
+        list(pool.map(ingest, filepaths))
+
+    if accumulator.rows == 0:
+        raise ValueError("データ行がありません")
+    logger.info(
+        f"統合読み込み完了: {len(filepaths)}ファイル, {accumulator.rows}行, "
+        f"ID {len(accumulator.id_codes)}件, キャンペーン {len(accumulator.campaign_codes)}件"
+    )
+    return accumulator.result(progress, workers)
+
+def to_cooccurrence_frame(counts, unique_campaigns):
+    """共起回数の疎行列をキャンペーン名をラベルに持つ密なDataFrameに変換する"""
+    return pd.DataFrame(
+        counts.toarray(),
+        index=unique_campaigns,
+        columns=unique_campaigns
+    )
+
+def write_cooccurrence_xlsx(output_filepath, co_occurrence_matrix, total_row=True, sheet_name='共起行列'):
+    """合計行付きの共起行列を openpyxl の write-only モードで1パスで書き出す
+
+    列幅は行列を文字列化せず、各列の最大値の桁数とラベルの長さから求める。
+    見出し・合計行のスタイルは書き込みと同時に設定する。
+    total_row が False なら最終行も通常の行として書く（関連度指標の行列など）。欠損値は空欄にする。
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+    from openpyxl.utils import get_column_letter
+
+    # pandas の to_excel と同じ見出しセルのスタイル
+    header_font = Font(bold=True)
+    header_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    header_alignment = Alignment(horizontal='center', vertical='top')
+    # 合計行のスタイル
+    total_font = Font(bold=True)
+    total_fill = PatternFill(start_color='F0F0F0', end_color='F0F0F0', fill_type='solid')
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+
+    labels = list(co_occurrence_matrix.columns)
+    values = co_occurrence_matrix.to_numpy()
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), 0, values)
+        rows = co_occurrence_matrix.astype(object).where(co_occurrence_matrix.notna(), None).values.tolist()
+    else:
+        rows = values.tolist()
+
+    # 列幅の自動調整（write-only モードでは行の書き込み前に設定する）
+    column_max = values.max(axis=0).tolist() if len(values) else [0] * len(labels)
+    for idx, (col, max_value) in enumerate(zip(labels, column_max)):
+        max_length = max(len(str(max_value)), len(str(col)))
+        worksheet.column_dimensions[get_column_letter(idx + 2)].width = max_length + 2
+
+    def header_cell(value, fill=None):
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.font = header_font
+        cell.border = header_border
+        cell.alignment = header_alignment
+        if fill:
+            cell.fill = fill
+        return cell
+
+    def total_cell(value):
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.font = total_font
+        cell.fill = total_fill
+        return cell
+
+    worksheet.append([None] + [header_cell(col) for col in labels])
+    last = len(values) - 1 if total_row else -1
+    for i, (label, row) in enumerate(zip(co_occurrence_matrix.index, rows)):
+        if i == last:
+            # 合計行のスタイル設定
+            worksheet.append([header_cell(label, total_fill)] + [total_cell(v) for v in row])
+        else:
+            worksheet.append([header_cell(label)] + row)
+
+    workbook.save(output_filepath)
+
+# 結果キャッシュ
+# 計算方法や出力形式が変わったときに古いキャッシュを使わないためのバージョン
+RESULT_CACHE_VERSION = 1
+# ヒット・ミス・削除の回数はワーカープロセスごとに数える（キャッシュ本体はプロセス間で共有）
+result_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+result_cache_lock = threading.Lock()
+
+def content_hash_path(filepath):
+    """アップロード時に計算した SHA-256 の保存先（アップロードファイルと同じ場所）"""
+    return f"{filepath}.sha256.json"
+
+def save_content_hash(filepath, sha256):
+    """アップロード時に計算した SHA-256 をファイルのサイズ・更新時刻とともに保存する"""
+    stat = os.stat(filepath)
+    with open(content_hash_path(filepath), 'w', encoding='utf-8') as f:
+        json.dump({'sha256': sha256, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, f)
+
+def load_content_hash(filepath):
+    """保存済みの SHA-256 を返す（ファイルが変わっていれば None）"""
+    try:
+        with open(content_hash_path(filepath), encoding='utf-8') as f:
+            data = json.load(f)
+        stat = os.stat(filepath)
+        if data['size'] == stat.st_size and data['mtime_ns'] == stat.st_mtime_ns:
+            return data['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def file_sha256(filepath, block_size=1024 * 1024):
+    """ファイル内容の SHA-256 を返す（分割アップロードで計算済みならそれを使う）"""
+    sha256 = load_content_hash(filepath)
+    if sha256:
+        return sha256
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def result_cache_dir():
+    """結果キャッシュのディレクトリ（OUTPUT_FOLDER 配下）"""
+    path = os.path.join(app.config['OUTPUT_FOLDER'], '_cache')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def result_cache_key(filepath, options):
+    """アップロードファイルの内容と処理オプションからキャッシュキーを作る
+
+    filepath にリストを渡すと（統合モード）、各ファイルの内容ハッシュを並べ替えて使うため
+    ファイルの順序が違っても同じキーになる。
+    """
+    if isinstance(filepath, (list, tuple)):
+        content = sorted(file_sha256(path) for path in filepath)
+    else:
+        content = file_sha256(filepath)
+    payload = json.dumps(
+        {'version': RESULT_CACHE_VERSION, 'content': content, 'options': options},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def link_or_copy(src, dst):
+    """src を dst にハードリンク（できなければコピー）し、dst を原子的に置き換える"""
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def restore_cached_result(cache_key, outputs):
+    """キャッシュがあれば出力先に配置して True を返す（ヒット・ミスを記録する）
+
+    outputs は {キャッシュ上の名前: 出力ファイルのパス}。全ての出力が揃っている場合だけヒットとする。
+    """
+    try:
+        for name, output_filepath in outputs.items():
+            cache_path = os.path.join(result_cache_dir(), f"{cache_key}.{name}")
+            link_or_copy(cache_path, output_filepath)
+            os.utime(cache_path)  # LRU のため最終使用時刻を更新
+    except FileNotFoundError:
+        with result_cache_lock:
+            result_cache_stats['misses'] += 1
+        return False
+    with result_cache_lock:
+        result_cache_stats['hits'] += 1
+    return True
+
+def store_cached_result(cache_key, outputs):
+    """出力ファイルをキャッシュに登録し、上限を超えた分を古い順に削除する"""
+    try:
+        for name, output_filepath in outputs.items():
+            link_or_copy(output_filepath, os.path.join(result_cache_dir(), f"{cache_key}.{name}"))
+        evict_result_cache()
+    except OSError as e:
+        logger.warning(f"結果キャッシュへの保存に失敗: {str(e)}")
+
+def result_cache_entries():
+    """キャッシュのエントリを (最終使用時刻, サイズ, パス) の古い順で返す"""
+    entries = []
+    with os.scandir(result_cache_dir()) as it:
+        for entry in it:
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return sorted(entries)
+
+def evict_result_cache():
+    """キャッシュの合計サイズが RESULT_CACHE_MAX_BYTES 以下になるまで LRU で削除する"""
+    entries = result_cache_entries()
+    total = sum(size for _, size, _ in entries)
+    max_bytes = app.config['RESULT_CACHE_MAX_BYTES']
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        with result_cache_lock:
+            result_cache_stats['evictions'] += 1
+        logger.info(f"結果キャッシュを削除: {os.path.basename(path)}")
+
+def write_cooccurrence_result(counts, unique_campaigns, output_filepath, file_ext, progress=None):
+    """共起回数に合計行を付けて CSV / xlsx / Parquet / Arrow IPC に保存する
+
+    キャッシュとハードリンクを共有するため、一時ファイルに書いてから置き換える。
+    """
+    co_occurrence_matrix = to_cooccurrence_frame(counts, unique_campaigns)
+
+    # 合計行を追加（1行のみ）
+    sums = co_occurrence_matrix.sum()
+    co_occurrence_matrix.loc['合計'] = sums
+    if progress:
+        progress('assembled', campaigns=len(unique_campaigns))
     
-    return has_id and has_campaign
+    # ファイル形式に応じて保存
+    if progress:
+        progress('write_started')
+    if file_ext == 'xlsx':
+        tmp_filepath = f"{output_filepath}.{uuid.uuid4().hex}.tmp"
+        write_cooccurrence_xlsx(tmp_filepath, co_occurrence_matrix)
+        os.replace(tmp_filepath, output_filepath)
+    else:
+        write_table(co_occurrence_matrix, output_filepath, file_ext, index=True)
+    if progress:
+        progress('write_finished')
+
+def write_cooccurrence_npz(counts, unique_campaigns, npz_filepath, labels_filepath, progress=None):
+    """共起回数の疎行列を NPZ で、キャンペーン名を JSON のサイドカーで保存する
+
+    合計行は含めない（列和で求められる）。読み込みを速くするため圧縮しない。
+    """
+    if progress:
+        progress('assembled', campaigns=len(unique_campaigns))
+
+    if progress:
+        progress('write_started')
+    tmp_filepath = f"{npz_filepath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filepath, 'wb') as f:
+        sparse.save_npz(f, counts.tocsr(), compressed=False)
+    os.replace(tmp_filepath, npz_filepath)
+
+    tmp_filepath = f"{labels_filepath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        json.dump([str(label) for label in unique_campaigns], f, ensure_ascii=False)
+    os.replace(tmp_filepath, labels_filepath)
+    if progress:
+        progress('write_finished')
+
+# 照会用インデックス
+# 作成した共起回数を疎行列（CSR）とキャンペーン名の索引として OUTPUT_FOLDER/_index に保存し、
+# 出力ファイル全体をダウンロードしなくても1キャンペーンの行・部分行列・上位ペアを JSON で返す。
+# インデックスは最初の出力ファイル名で識別し、読み込んだものは少数だけメモリに保持する。
+MATRIX_INDEX_CACHE_SIZE = 8
+# 1回の照会で返す件数・キャンペーン数の上限
+MATRIX_QUERY_MAX_LIMIT = 1000
+MATRIX_QUERY_MAX_CAMPAIGNS = 200
+matrix_indexes = OrderedDict()
+matrix_indexes_lock = threading.Lock()
+
+def matrix_index_dir():
+    """照会用インデックスの保存先（OUTPUT_FOLDER 配下）"""
+    path = os.path.join(app.config['OUTPUT_FOLDER'], '_index')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def matrix_index_path(name):
+    """出力ファイル名に対応するインデックスのパス"""
+    path = safe_join(matrix_index_dir(), f"{name}.npz")
+    if path is None:
+        raise ValueError(f"無効な名前です: {name}")
+    return path
+
+def write_matrix_index(counts, unique_campaigns, support, total_ids, index_filepath):
+    """共起回数（CSR）・キャンペーン名・支持度・全ID数を1つの NPZ に保存する（読み込みを速くするため圧縮しない）"""
+    counts = counts.tocsr()
+    tmp_filepath = f"{index_filepath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filepath, 'wb') as f:
+        np.savez(
+            f,
+            data=counts.data,
+            indices=counts.indices,
+            indptr=counts.indptr,
+            shape=np.array(counts.shape),
+            labels=np.array([str(label) for label in unique_campaigns], dtype=str),
+            support=np.asarray(support),
+            total_ids=np.array(total_ids)
+        )
+    os.replace(tmp_filepath, index_filepath)
+
+class MatrixIndex:
+    """保存した共起回数に対する照会（キャンペーンの行・部分行列・上位ペア）"""
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            self.counts = sparse.csr_matrix(
+                (data['data'], data['indices'], data['indptr']), shape=tuple(data['shape'])
+            )
+            self.labels = data['labels'].tolist()
+            self.support = data['support']
+            self.total_ids = int(data['total_ids'])
+        self.positions = {label: i for i, label in enumerate(self.labels)}
+        self._pairs = None
+        self._pairs_lock = threading.Lock()
+
+    def position(self, label):
+        try:
+            return self.positions[label]
+        except KeyError:
+            raise KeyError(f"キャンペーンが見つかりません: {label}") from None
+
+    def row(self, label, offset=0, limit=50):
+        """1キャンペーンと共起するキャンペーンを共起回数の多い順に返す"""
+        i = self.position(label)
+        start, end = self.counts.indptr[i], self.counts.indptr[i + 1]
+        indices, data = self.counts.indices[start:end], self.counts.data[start:end]
+        order = np.lexsort((indices, -data))[offset:offset + limit]
+        return {
+            'campaign': label,
+            'support': int(self.support[i]),
+            'total': int(end - start),
+            'items': [
+                {'campaign': self.labels[j], 'count': int(count)}
+                for j, count in zip(indices[order].tolist(), data[order].tolist())
+            ]
+        }
+
+    def submatrix(self, labels):
+        """指定したキャンペーン同士の共起回数を行列で返す（対角は支持度）"""
+        positions = [self.position(label) for label in labels]
+        block = self.counts[positions][:, positions].toarray()
+        np.fill_diagonal(block, self.support[positions])
+        return {'campaigns': list(labels), 'counts': block.tolist()}
+
+    def pairs(self):
+        """上三角の (行, 列, 共起回数) を共起回数の多い順に並べたもの（初回だけ作成）"""
+        with self._pairs_lock:
+            if self._pairs is None:
+                upper = sparse.triu(self.counts, k=1).tocoo()
+                order = np.lexsort((upper.col, upper.row, -upper.data))
+                self._pairs = (upper.row[order], upper.col[order], upper.data[order])
+            return self._pairs
+
+    def top_pairs(self, offset=0, limit=50, min_count=None):
+        """共起回数の多い順のペアを返す（min_count 未満は数えない）"""
+        rows, cols, data = self.pairs()
+        total = len(data)
+        if min_count is not None:
+            total = int(np.searchsorted(-data, -min_count, side='right'))
+        end = min(offset + limit, total)
+        return {
+            'total': total,
+            'items': [
+                {'campaign_a': self.labels[i], 'campaign_b': self.labels[j], 'count': int(count)}
+                for i, j, count in zip(rows[offset:end].tolist(), cols[offset:end].tolist(),
+                                       data[offset:end].tolist())
+            ]
+        }
+
+def load_matrix_index(name):
+    """インデックスを読み込む（更新されていなければメモリ上のものを使う）"""
+    path = matrix_index_path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        raise KeyError(f"共起行列が見つかりません: {name}") from None
+
+    with matrix_indexes_lock:
+        entry = matrix_indexes.get(path)
+        if entry and entry[0] == mtime:
+            matrix_indexes.move_to_end(path)
+            return entry[1]
+
+    index = MatrixIndex(path)
+    with matrix_indexes_lock:
+        matrix_indexes[path] = (mtime, index)
+        matrix_indexes.move_to_end(path)
+        while len(matrix_indexes) > MATRIX_INDEX_CACHE_SIZE:
+            matrix_indexes.popitem(last=False)
+    return index
+
+# 出力モード（matrix: 共起行列, pairs: ペアの長形式と合計表）と形式
+OUTPUT_MODES = ('matrix', 'pairs')
+MATRIX_OUTPUT_FORMATS = ('csv', 'xlsx', 'parquet', 'arrow', 'npz')
+PAIR_OUTPUT_FORMATS = ('csv', 'parquet', 'arrow')
+# 共起回数と支持度から計算できる関連度指標
+ASSOCIATION_METRICS = ('jaccard', 'lift', 'pmi', 'cosine')
+
+def parse_cooccurrence_options(data):
+    """リクエストの処理オプションを検証し、process_cooccurrence_file の引数にする"""
+    output_mode = data.get('output_mode') or 'matrix'
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"無効な出力モードです: {output_mode}")
+
+    output_format = data.get('output_format')
+    if output_mode == 'pairs':
+        output_format = output_format or 'csv'
+        if output_format not in PAIR_OUTPUT_FORMATS:
+            raise ValueError(f"無効な出力形式です: {output_format}")
+    elif output_format and output_format not in MATRIX_OUTPUT_FORMATS:
+        raise ValueError(f"無効な出力形式です: {output_format}")
+
+    options = {
+        'streaming': data.get('streaming'),
+        'workers': data.get('workers'),
+        'clean_campaigns': bool(data.get('clean_campaigns', False)),
+        'output_mode': output_mode,
+        'output_format': output_format
+    }
+    for name in ('min_count', 'top_k'):
+        value = data.get(name)
+        if value is not None:
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError(f"{name} は1以上の整数で指定してください")
+            if output_mode != 'pairs':
+                raise ValueError(f"{name} は output_mode が pairs の場合のみ指定できます")
+        options[name] = value
+
+    metrics = data.get('metrics') or []
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    unknown = [m for m in metrics if m not in ASSOCIATION_METRICS]
+    if unknown:
+        raise ValueError(f"無効な関連度指標です: {', '.join(map(str, unknown))}")
+    options['metrics'] = [m for m in ASSOCIATION_METRICS if m in metrics]
+    return options
+
+def cooccurrence_output_names(base_name, file_ext, output_mode, output_format, metrics=()):
+    """出力モードごとの {キャッシュ上の名前: 出力ファイル名}（共起行列の形式は未指定なら入力と同じ）
+
+    共起行列の出力で metrics を指定した場合は、支持度の表と指標ごとの行列のファイルを加える。
+    ペアの出力では指標はペアの表の列、支持度は合計表の列になるためファイルは増えない。
+    """
+    if output_mode == 'pairs':
+        return {
+            f'pairs.{output_format}': f"共起ペア_{base_name}.{output_format}",
+            f'totals.{output_format}': f"共起合計_{base_name}.{output_format}"
+        }
+    output_format = output_format or file_ext
+    if output_format == 'npz':
+        names = {
+            'npz': f"共起行列_{base_name}.npz",
+            'labels.json': f"共起行列_{base_name}.labels.json"
+        }
+    else:
+        names = {output_format: f"共起行列_{base_name}.{output_format}"}
+    if metrics:
+        names[f'support.{output_format}'] = f"共起支持度_{base_name}.{output_format}"
+        for metric in metrics:
+            names[f'{metric}.{output_format}'] = f"共起指標_{metric}_{base_name}.{output_format}"
+    return names
+
+def association_values(rows, cols, data, support, total_ids, metrics):
+    """共起のあるペア (rows, cols, 共起回数) について関連度指標を計算する
+
+    jaccard = c / (s_a + s_b - c)、lift = c·N / (s_a·s_b)、pmi = ln(lift)、cosine = c / √(s_a·s_b)。
+    s はキャンペーンごとのユニークID数、N は全ID数。戻り値は {指標名: 値の配列}。
+    """
+    if not metrics:
+        # 指標を求めない場合は支持度がなくてもよい（support=None）
+        return {}
+    c = np.asarray(data, dtype=np.float64)
+    s_a = support[rows].astype(np.float64)
+    s_b = support[cols].astype(np.float64)
+    values = {}
+    for metric in metrics:
+        if metric == 'jaccard':
+            values[metric] = c / (s_a + s_b - c)
+        elif metric == 'lift':
+            values[metric] = c * total_ids / (s_a * s_b)
+        elif metric == 'pmi':
+            values[metric] = np.log(c * total_ids / (s_a * s_b))
+        elif metric == 'cosine':
+            values[metric] = c / np.sqrt(s_a * s_b)
+    return values
+
+def cooccurrence_pairs(counts, unique_campaigns, min_count=None, top_k=None,
+                       support=None, total_ids=None, metrics=()):
+    """共起回数の疎行列からペアの長形式（campaign_a, campaign_b, count）を作る
+
+    密な行列は作らず、非ゼロ要素だけを扱う。min_count 未満のペアは除く。
+    top_k を指定した場合はキャンペーンごとに共起回数の多い順に top_k 件の相手を返す
+    （同じペアが両方のキャンペーンから現れることがある）。指定しない場合は各ペアを1回だけ返す。
+    metrics を指定すると関連度指標の列を加える（support と total_ids が必要）。
+    """
+    counts = counts.tocsr()
+    counts.sort_indices()
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    cols, data = counts.indices, counts.data
+
+    mask = data >= (min_count or 1)
+    if not top_k:
+        mask &= rows < cols
+    rows, cols, data = rows[mask], cols[mask], data[mask]
+
+    # キャンペーンごとに回数の降順（同数ならラベル順）に並べる
+    order = np.lexsort((cols, -data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    if top_k:
+        starts = np.searchsorted(rows, np.arange(counts.shape[0]))
+        rank = np.arange(len(rows)) - starts[rows]
+        keep = rank < top_k
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+    else:
+        order = np.argsort(-data, kind='stable')
+        rows, cols, data = rows[order], cols[order], data[order]
+
+    labels = np.asarray(unique_campaigns, dtype=object)
+    pairs = pd.DataFrame({
+        'campaign_a': labels[rows],
+        'campaign_b': labels[cols],
+        'count': data
+    })
+    for metric, values in association_values(rows, cols, data, support, total_ids, metrics).items():
+        pairs[metric] = values
+    return pairs
+
+def cooccurrence_totals(counts, unique_campaigns, support=None, total_ids=None):
+    """共起行列の合計行をキャンペーンごとの表にする（支持度があればその列も加える）"""
+    totals = pd.DataFrame({
+        'campaign': list(unique_campaigns),
+        '合計': np.asarray(counts.sum(axis=0)).ravel()
+    })
+    if support is not None:
+        totals['support'] = support
+        totals['total_ids'] = total_ids
+    return totals
+
+def association_matrix(counts, support, total_ids, metric):
+    """関連度指標の疎行列（共起のあるペアだけが値を持つ）を返す"""
+    counts = counts.tocoo()
+    values = association_values(counts.row, counts.col, counts.data, support, total_ids, [metric])[metric]
+    return sparse.csr_matrix((values, (counts.row, counts.col)), shape=counts.shape)
+
+def write_metric_outputs(counts, unique_campaigns, support, total_ids, metrics, output_filepaths,
+                         output_format):
+    """支持度の表と関連度指標の行列を共起行列と同じ形式で保存する
+
+    共起のないペアと対角成分は、pmi では欠損値、それ以外の指標では0とする（npz では要素なし）。
+    """
+    if output_format == 'npz':
+        tmp_filepath = f"{output_filepaths['support.npz']}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filepath, 'wb') as f:
+            np.savez(f, support=support, total_ids=np.int64(total_ids))
+        os.replace(tmp_filepath, output_filepaths['support.npz'])
+    else:
+        support_table = pd.DataFrame({
+            'campaign': list(unique_campaigns),
+            'support': support,
+            'total_ids': total_ids
+        })
+        write_table(support_table, output_filepaths[f'support.{output_format}'], output_format)
+
+    for metric in metrics:
+        output_filepath = output_filepaths[f'{metric}.{output_format}']
+        matrix = association_matrix(counts, support, total_ids, metric)
+        tmp_filepath = f"{output_filepath}.{uuid.uuid4().hex}.tmp"
+        if output_format == 'npz':
+            with open(tmp_filepath, 'wb') as f:
+                sparse.save_npz(f, matrix, compressed=False)
+            os.replace(tmp_filepath, output_filepath)
+            continue
+
+        dense = np.full(matrix.shape, np.nan if metric == 'pmi' else 0.0)
+        coo = matrix.tocoo()
+        dense[coo.row, coo.col] = coo.data
+        frame = pd.DataFrame(dense, index=unique_campaigns, columns=unique_campaigns)
+        if output_format == 'xlsx':
+            write_cooccurrence_xlsx(tmp_filepath, frame, total_row=False, sheet_name=metric)
+            os.replace(tmp_filepath, output_filepath)
+        else:
+            write_table(frame, output_filepath, output_format, index=True)
+
+def arrow_compatible(df, index=False):
+    """Parquet / Arrow で保存できるように、ラベルと文字列以外が混在する列を文字列にする
+
+    数値のキャンペーン名と「合計」のように型の混在するラベルは Arrow に変換できないため、
+    write_matrix_index と同じくラベルを文字列として保存する。
+    """
+    df = df.copy(deep=False)
+    df.columns = [str(col) for col in df.columns]
+    if index:
+        df.index = df.index.map(str)
+    for col in df.columns[df.dtypes.to_numpy() == object]:
+        values = df[col]
+        df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+def write_table(df, output_filepath, output_format, index=False):
+    """表を CSV / xlsx / Parquet / Arrow IPC で一時ファイル経由で保存する"""
+    tmp_filepath = f"{output_filepath}.{uuid.uuid4().hex}.tmp"
+    if output_format in ('parquet', 'arrow'):
+        df = arrow_compatible(df, index)
+    if output_format == 'parquet':
+        df.to_parquet(tmp_filepath, index=index)
+    elif output_format == 'arrow':
+        # メモリマップで読めるように IPC ファイル形式で書く
+        table = pa.Table.from_pandas(df, preserve_index=index)
+        with pa.OSFile(tmp_filepath, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    elif output_format == 'xlsx':
+        with open(tmp_filepath, 'wb') as f:
+            df.to_excel(f, index=index, engine='openpyxl')
+    else:
+        df.to_csv(tmp_filepath, encoding='utf-8-sig', index=index)
+    os.replace(tmp_filepath, output_filepath)
+
+def write_pair_outputs(counts, unique_campaigns, output_filepaths, output_format,
+                       min_count=None, top_k=None, progress=None, support=None, total_ids=None, metrics=()):
+    """ペアの長形式と合計表を保存する（output_filepaths は {キャッシュ上の名前: パス}）
+
+    metrics を指定するとペアの表に関連度指標、合計表に支持度と全ID数の列を加える。
+    """
+    pairs = cooccurrence_pairs(counts, unique_campaigns, min_count, top_k, support, total_ids, metrics)
+    totals = cooccurrence_totals(counts, unique_campaigns, support if metrics else None, total_ids)
+    if progress:
+        progress('assembled', campaigns=len(unique_campaigns), pairs=len(pairs))
+
+    if progress:
+        progress('write_started')
+    write_table(pairs, output_filepaths[f'pairs.{output_format}'], output_format)
+    write_table(totals, output_filepaths[f'totals.{output_format}'], output_format)
+    if progress:
+        progress('write_finished')
+
+def prepare_cooccurrence_outputs(base_name, file_ext, output_mode='matrix', output_format=None, metrics=(),
+                                 output_prefix=None):
+    """出力形式を決め、(出力形式, 指標, {キャッシュ上の名前: 出力パス}, 戻り値) を返す
+
+    戻り値は出力ファイルが1つなら出力ファイル名、複数ならそのリスト。
+    output_prefix（ジョブID）を渡すと出力ファイル名は「<output_prefix>/<ファイル名>」になる。
+    """
+    if output_mode == 'matrix':
+        output_format = output_format or file_ext
+    metrics = list(metrics or [])
+    output_names = {
+        name: artifact_name(output_prefix, filename)
+        for name, filename in cooccurrence_output_names(base_name, file_ext, output_mode, output_format, metrics).items()
+    }
+    output_filepaths = {name: output_path(filename) for name, filename in output_names.items()}
+    output_filenames = list(output_names.values())
+    result = output_filenames[0] if len(output_filenames) == 1 else output_filenames
+    # 照会用インデックスも結果キャッシュの対象にする（出力ファイルとしては返さない）
+    output_filepaths['index.npz'] = matrix_index_path(output_filenames[0])
+    os.makedirs(os.path.dirname(output_filepaths['index.npz']), exist_ok=True)
+    return output_format, metrics, output_filepaths, result
+
+def write_cooccurrence_outputs(counts, unique_campaigns, support, total_ids, output_filepaths, output_mode,
+                               output_format, min_count=None, top_k=None, metrics=(), progress=None):
+    """集計結果を出力モード・形式に応じて書き出す（指標の出力を含む）"""
+    if progress:
+        progress('counted', ids=total_ids, campaigns=len(unique_campaigns), pairs=counts.nnz // 2)
+
+    if output_mode == 'pairs':
+        write_pair_outputs(
+            counts, unique_campaigns, output_filepaths, output_format, min_count, top_k, progress,
+            support, total_ids, metrics
+        )
+    elif output_format == 'npz':
+        write_cooccurrence_npz(
+            counts, unique_campaigns, output_filepaths['npz'], output_filepaths['labels.json'], progress
+        )
+    else:
+        write_cooccurrence_result(
+            counts, unique_campaigns, output_filepaths[output_format], output_format, progress
+        )
+    if metrics and output_mode == 'matrix':
+        write_metric_outputs(
+            counts, unique_campaigns, support, total_ids, metrics, output_filepaths, output_format
+        )
+    write_matrix_index(counts, unique_campaigns, support, total_ids, output_filepaths['index.npz'])
+
+def process_cooccurrence_file(filepath, original_filename, progress=None, streaming=None, workers=None,
+                              clean_campaigns=False, output_mode='matrix', output_format=None,
+                              min_count=None, top_k=None, metrics=(), output_prefix=None):
+    """共起行列ファイルの作成
+
+    progress を渡すと処理段階ごとに progress(段階名, **情報) が呼ばれる。
+    streaming が True（未指定の場合は大きなCSV）ならチャンクごとに読み込む。
+    workers は共起回数を計算するプロセス数（未指定なら COOCCURRENCE_WORKERS）。
+    clean_campaigns が True ならキャンペーン名をクリーニングしてから集計する
+    （元データ整形ツールの出力を再アップロードした場合と同じ結果になる）。
+    output_format は共起行列の出力形式（csv / xlsx / parquet / arrow / npz、未指定なら入力と同じ）。
+    npz の場合は疎行列とキャンペーン名の JSON を別々のファイルに出力する。
+    output_mode が 'pairs' なら共起行列の代わりにペアの長形式（min_count / top_k で絞り込み）と
+    合計表を output_format（csv / parquet / arrow）で出力する。
+    metrics（jaccard / lift / pmi / cosine）を指定すると、集計と同じ1回の読み込みで得た
+    キャンペーンごとのユニークID数と全ID数から関連度指標も出力する。
+    output_prefix（ジョブID）を渡すと出力ファイルはそのディレクトリの下に置く。
+    出力ファイルが1つなら出力ファイル名を、複数ならそのリストを返す。
+    """
+    try:
+        workers = min(int(workers or app.config['COOCCURRENCE_WORKERS']), os.cpu_count() or 1)
+
+        # ファイルの拡張子を取得
+        file_ext = original_filename.rsplit('.', 1)[1].lower()
+
+        # 結果ファイルのパス
+        base_name = os.path.splitext(original_filename)[0]
+        output_format, metrics, output_filepaths, result = prepare_cooccurrence_outputs(
+            base_name, file_ext, output_mode, output_format, metrics, output_prefix
+        )
+
+        # 同じ内容・同じオプションの結果があれば再計算しない
+        clean_campaigns = bool(clean_campaigns)
+        cache_key = result_cache_key(filepath, {
+            'format': file_ext,
+            'clean_campaigns': clean_campaigns,
+            'output_mode': output_mode,
+            'output_format': output_format,
+            'min_count': min_count,
+            'top_k': top_k,
+            'metrics': metrics
+        })
+        if restore_cached_result(cache_key, output_filepaths):
+            logger.info(f"結果キャッシュを使用: {original_filename} -> {result}")
+            if progress:
+                progress('write_finished', cached=True)
+            return result
+        
+        if file_ext == 'xlsx':
+            # read_only モードで1回だけ開き、ID列とキャンペーン列だけを集計
+            counts, unique_campaigns, support, total_ids = stream_xlsx_cooccurrence_counts(
+                filepath, progress, workers=workers, clean_campaigns=clean_campaigns
+            )
+        elif use_streaming(filepath, file_ext, streaming):
+            # ID列とキャンペーン列だけをチャンクごとに集計
+            counts, unique_campaigns, support, total_ids = stream_cooccurrence_counts(
+                filepath, file_ext, progress, workers=workers, clean_campaigns=clean_campaigns
+            )
+        else:
+            # ヘッダー行の特定とデータ読み込み（パースプランがあれば検出を省略）
+            header_row, df, plan = read_input_file(filepath, file_ext, progress)
+            
+            # 必要なカラム名を特定
+            if plan:
+                id_column, campaign_column = plan['id_column'], plan['campaign_column']
+            else:
+                id_column, campaign_column = get_column_names(df)
+            
+            if progress:
+                progress('parsed', rows=len(df))
+
+            # 必要な列のみを抽出して列名を標準化
+            df_processed = df[[id_column, campaign_column]].copy()
+            df_processed.columns = ["見込客/担当者ID18", "キャンペーン名"]
+
+            # キャンペーン名のクリーニング（メモを共有し、ファイルを経由せずに集計へ渡す）
+            if clean_campaigns:
+                df_processed["キャンペーン名"] = clean_campaign_names(df_processed["キャンペーン名"])
+
+            # 共起行列の作成（疎行列による XᵀX）
+            counts, unique_campaigns, support, total_ids = build_cooccurrence_counts(
+                df_processed["見込客/担当者ID18"], df_processed["キャンペーン名"], progress, workers
+            )
+
+        write_cooccurrence_outputs(
+            counts, unique_campaigns, support, total_ids, output_filepaths, output_mode, output_format,
+            min_count, top_k, metrics, progress
+        )
+        store_cached_result(cache_key, output_filepaths)
+
+        return result
+
+    except Exception as e:
+        logger.error(f"ファイル処理エラー: {str(e)}", exc_info=True)
+        raise
+
+def process_merged_cooccurrence_files(filepaths, original_filenames, progress=None, workers=None,
+                                      clean_campaigns=False, output_mode='matrix', output_format=None,
+                                      min_count=None, top_k=None, metrics=(), output_prefix=None):
+    """複数ファイルをIDで統合した1つの共起行列ファイルの作成（統合モード）
+
+    各ファイルを並行して読み込み、全ファイル共通のキャンペーン名で1つの行列を作る。
+    同じIDが複数のファイルにあれば1人として扱い、同じ (ID, キャンペーン) は1回だけ数える。
+    出力ファイル名は「統合_{最初のファイル名}_他{n-1}件」で、出力形式の既定は最初のファイルの形式。
+    その他の引数と戻り値は process_cooccurrence_file と同じ。
+    """
+    try:
+        workers = min(int(workers or app.config['COOCCURRENCE_WORKERS']), os.cpu_count() or 1)
+
+        file_ext = original_filenames[0].rsplit('.', 1)[1].lower()
+        base_name = f"統合_{os.path.splitext(original_filenames[0])[0]}_他{len(original_filenames) - 1}件"
+        output_format, metrics, output_filepaths, result = prepare_cooccurrence_outputs(
+            base_name, file_ext, output_mode, output_format, metrics, output_prefix
+        )
+
+        # 同じファイルの組み合わせ・同じオプションの結果があれば再計算しない
+        clean_campaigns = bool(clean_campaigns)
+        cache_key = result_cache_key(filepaths, {
+            'merged': True,
+            'clean_campaigns': clean_campaigns,
+            'output_mode': output_mode,
+            'output_format': output_format,
+            'min_count': min_count,
+            'top_k': top_k,
+            'metrics': metrics
+        })
+        if restore_cached_result(cache_key, output_filepaths):
+            logger.info(f"結果キャッシュを使用: {len(filepaths)}ファイルの統合 -> {result}")
+            if progress:
+                progress('write_finished', cached=True)
+            return result
+
+        counts, unique_campaigns, support, total_ids = merged_cooccurrence_counts(
+            filepaths, progress, workers=workers, clean_campaigns=clean_campaigns
+        )
+        write_cooccurrence_outputs(
+            counts, unique_campaigns, support, total_ids, output_filepaths, output_mode, output_format,
+            min_count, top_k, metrics, progress
+        )
+        store_cached_result(cache_key, output_filepaths)
+
+        return result
+
+    except Exception as e:
+        logger.error(f"統合処理エラー: {str(e)}", exc_info=True)
+        raise
+
+def process_campaign_file(filepath, original_filename, progress=None, output_prefix=None):
+    """キャンペーンファイルの処理（改善版）
+
+    progress を渡すと処理段階ごとに progress(段階名, **情報) が呼ばれる。
+    output_prefix（ジョブID）を渡すと出力ファイルはそのディレクトリの下に置く。
+    """
+    try:
+        # ファイルの拡張子を取得
+        file_ext = original_filename.rsplit('.', 1)[1].lower()
+        
+        # ファイルの存在確認
+        if not os.path.exists(filepath):
+            raise ValueError(f"ファイルが見つかりません: {filepath}")
+        
+        # ファイルサイズの確認
+        if os.path.getsize(filepath) == 0:
+            raise ValueError("ファイルが空です")
+            
+        try:
+            # ヘッダー行の特定とデータ読み込み（パースプランがあれば検出を省略）
+            header_row, df, plan = read_input_file(filepath, file_ext, progress)
+            logger.info(f"ヘッダー行を特定: {header_row}行目")
+            logger.info(f"検出されたカラム: {', '.join(df.columns)}")
+            if progress:
+                progress('parsed', rows=len(df))
+            
+        except Exception as e:
+            logger.error(f"ヘッダー行の特定に失敗: {str(e)}")
+            raise ValueError(f"データ構造を認識できませんでした。\nエラー: {str(e)}")
+        
+        # 必要なカラム名を特定
+        try:
+            if plan:
+                id_column, campaign_column = plan['id_column'], plan['campaign_column']
+            else:
+                id_column, campaign_column = get_column_names(df)
+            logger.info(f"特定されたカラム - ID: {id_column}, キャンペーン: {campaign_column}")
+            
+        except Exception as e:
+            logger.error(f"カラム名の特定に失敗: {str(e)}")
+            raise ValueError(f"必要なカラムが見つかりません。\nエラー: {str(e)}")
+        
+        # キャンペーン名のクリーニング
+        df[campaign_column] = clean_campaign_names(df[campaign_column])
+        if progress:
+            progress('cleaned', rows=len(df))
+        
+        # 出力ファイルの準備
+        output_filename = artifact_name(output_prefix, f"cleaned_{sanitize_filename(original_filename)}")
+        output_filepath = output_path(output_filename)
+        
+        # ファイルの保存
+        if progress:
+            progress('write_started')
+        write_table(df, output_filepath, file_ext)
+        if progress:
+            progress('write_finished')
+            
+        logger.info(f"ファイル処理完了: {output_filename}")
+        return output_filename
+
+    except Exception as e:
+        logger.error(f"ファイル処理エラー: {str(e)}", exc_info=True)
+        raise
+
+# 差分更新用の共起状態
+# IDごとのキャンペーン集合（ID×キャンペーンの接続行列）と共起回数を NPZ で保存し、
+# 差分ファイルの行が新たに作る組だけを加算する
+STATE_NAME_PATTERN = re.compile(r'^[\w\-]+$')
+
+def cooccurrence_state_path(state_name):
+    """共起状態の保存先パス（状態名は英数字・アンダースコア・ハイフンのみ）"""
+    if not STATE_NAME_PATTERN.match(state_name or ''):
+        raise ValueError(f"無効な状態名です: {state_name}")
+    os.makedirs(app.config['STATE_FOLDER'], exist_ok=True)
+    return os.path.join(app.config['STATE_FOLDER'], f"{state_name}.npz")
+
+@contextmanager
+def state_lock(state_name):
+    """状態ごとのファイルロック（別のワーカープロセスを含め、同じ状態への同時マージを直列化する）"""
+    lock_path = os.path.join(os.path.dirname(cooccurrence_state_path(state_name)), f"{state_name}.lock")
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_cooccurrence_state(path):
+    """保存済みの共起状態を読み込む（なければ空の状態を返す）
+
+    状態は ids・campaigns（ラベル）、incidence（ID×キャンペーン）、counts（キャンペーン×キャンペーン）の辞書。
+    """
+    if not os.path.exists(path):
+        return {
+            'ids': np.array([], dtype=str),
+            'campaigns': np.array([], dtype=str),
+            'incidence': sparse.csr_matrix((0, 0), dtype=np.int64),
+            'counts': sparse.csr_matrix((0, 0), dtype=np.int64)
+        }
+    with np.load(path) as data:
+        ids, campaigns = data['ids'], data['campaigns']
+        incidence_indices = data['incidence_indices']
+        return {
+            'ids': ids,
+            'campaigns': campaigns,
+            'incidence': sparse.csr_matrix(
+                (np.ones(len(incidence_indices), dtype=np.int64), incidence_indices, data['incidence_indptr']),
+                shape=(len(ids), len(campaigns))
+            ),
+            'counts': sparse.csr_matrix(
+                (data['counts_data'], data['counts_indices'], data['counts_indptr']),
+                shape=(len(campaigns), len(campaigns))
+            )
+        }
+
+def save_cooccurrence_state(path, state):
+    """共起状態を圧縮 NPZ として原子的に保存する（接続行列は値が全て1のため位置だけを保存）"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        ids=state['ids'],
+        campaigns=state['campaigns'],
+        incidence_indptr=state['incidence'].indptr,
+        incidence_indices=state['incidence'].indices,
+        counts_indptr=state['counts'].indptr,
+        counts_indices=state['counts'].indices,
+        counts_data=state['counts'].data
+    )
+    os.replace(tmp_path, path)
+
+def extend_labels(labels, values):
+    """既存のラベルに新しい値を出現順に追加し、(ラベル, 各値のコード) を返す"""
+    index = pd.Index(labels)
+    new_values = pd.unique(values[index.get_indexer(values) < 0])
+    labels = np.concatenate([labels, new_values.astype(str)])
+    return labels, pd.Index(labels).get_indexer(values)
+
+def merge_cooccurrence_delta(state, ids, campaigns):
+    """差分の (ID, キャンペーン名) を共起状態にマージし、統計を返す
+
+    既存の接続行列を X、差分で新たに加わる (ID, キャンペーン) を D とすると、
+    (X + D)ᵀ(X + D) - XᵀX = DᵀX + XᵀD + DᵀD なので、差分に含まれるIDの行だけで計算できる。
+    IDとキャンペーン名は文字列として扱い、どちらかが欠損している行は無視する。
+    """
+    mask = (ids.notna() & campaigns.notna()).to_numpy()
+    ids = ids[mask].astype(str).to_numpy()
+    campaigns = campaigns[mask].astype(str).to_numpy()
+
+    id_labels, id_codes = extend_labels(state['ids'], ids)
+    campaign_labels, campaign_codes = extend_labels(state['campaigns'], campaigns)
+    shape = (len(id_labels), len(campaign_labels))
+
+    incidence = state['incidence'].copy()
+    incidence.resize(shape)
+    counts = state['counts'].copy()
+    counts.resize((shape[1], shape[1]))
+
+    # 差分の組から既存の組を除き、新しい組だけを残す
+    delta = sparse.csr_matrix(
+        (np.ones(len(ids), dtype=np.int64), (id_codes, campaign_codes)), shape=shape
+    )
+    delta.sum_duplicates()
+    delta.data[:] = 1
+    delta = (delta - delta.multiply(incidence)).tocsr()
+    delta.eliminate_zeros()
+
+    # 差分に含まれるIDの行だけで共起回数の増分を計算
+    rows = np.unique(delta.nonzero()[0])
+    old_rows, new_rows = incidence[rows], delta[rows]
+    cross = (new_rows.T @ old_rows).tocsr()
+    added = (cross + cross.T + new_rows.T @ new_rows).tocsr()
+    added.setdiag(0)
+    added.eliminate_zeros()
+
+    state.update({
+        'ids': id_labels,
+        'campaigns': campaign_labels,
+        'incidence': (incidence + delta).tocsr(),
+        'counts': (counts + added).tocsr()
+    })
+    return {
+        'rows': int(mask.sum()),
+        'new_memberships': int(delta.nnz),
+        'new_pairs': int(added.sum() // 2),
+        'ids': len(id_labels),
+        'campaigns': len(campaign_labels)
+    }
+
+def state_cooccurrence_counts(state):
+    """状態の共起回数をソート済みキャンペーン名の順に並べ替えて返す"""
+    order = np.argsort(state['campaigns'], kind='stable')
+    return state['counts'][order][:, order].tocsr(), state['campaigns'][order].tolist()
+
+def process_delta_file(filepath, original_filename, progress=None, state_name=None, output_prefix=None):
+    """差分ファイルを共起状態にマージし、更新後の共起行列ファイルを作成する"""
+    try:
+        file_ext = original_filename.rsplit('.', 1)[1].lower()
+        path = cooccurrence_state_path(state_name)
+
+        header_row, df, plan = read_input_file(filepath, file_ext, progress)
+        if plan:
+            id_column, campaign_column = plan['id_column'], plan['campaign_column']
+        else:
+            id_column, campaign_column = get_column_names(df)
+        if progress:
+            progress('parsed', rows=len(df))
+
+        output_filename = artifact_name(output_prefix, f"共起行列_{state_name}.csv")
+        # 出力もロック中に書き出す（後から終わった古い状態で新しい差分を含む出力を上書きしない）
+        with state_lock(state_name):
+            state = load_cooccurrence_state(path)
+            stats = merge_cooccurrence_delta(state, df[id_column], df[campaign_column])
+            save_cooccurrence_state(path, state)
+            if progress:
+                progress('counted', ids=stats['ids'], campaigns=stats['campaigns'], pairs=state['counts'].nnz // 2)
+            logger.info(f"差分をマージ: {original_filename} -> {state_name} {stats}")
+
+            counts, unique_campaigns = state_cooccurrence_counts(state)
+            write_cooccurrence_result(counts, unique_campaigns, output_path(output_filename), 'csv', progress)
+        return output_filename
+
+    except Exception as e:
+        logger.error(f"差分マージエラー: {str(e)}", exc_info=True)
+        raise
+
+# 処理段階の計測
+# progress の段階名 -> 計測上の段階（直前の通知からの時間をその段階の所要時間とする）
+STAGE_EVENTS = {
+    'header_detected': 'detect',
+    'parsed': 'parse',
+    'cleaned': 'clean',
+    'counting': 'count',
+    'counted': 'count',
+    'assembled': 'assemble',
+    'write_started': 'assemble',
+    'write_finished': 'write'
+}
+# 件数として記録する progress の情報
+STAGE_COUNT_KEYS = ('rows', 'ids', 'campaigns', 'pairs')
+
+def current_rss():
+    """プロセスの現在のRSS（バイト）。取得できない環境では0を返す"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+class MemorySampler:
+    """プロセスのRSSを別スレッドで定期的に採取し、区間ごとのピークを返す
+
+    計測中の区間があるときだけスレッドを動かす。RSSはプロセス全体の値のため、
+    複数のファイルを並行して処理している間のピークは互いの使用量を含む。
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def open(self):
+        """区間を開始してトークンを返す"""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.windows[token] = current_rss()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return token
+
+    def peak(self, token):
+        """前回の呼び出し（または区間の開始）以降のピークを返し、次の区間を始める"""
+        rss = current_rss()
+        with self.lock:
+            value = max(self.windows.get(token, 0), rss)
+            if token in self.windows:
+                self.windows[token] = rss
+        return value
+
+    def close(self, token):
+        with self.lock:
+            self.windows.pop(token, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss()
+            with self.lock:
+                if not self.windows:
+                    self.thread = None
+                    return
+                for token, value in self.windows.items():
+                    self.windows[token] = max(value, rss)
+
+memory_sampler = MemorySampler()
+
+class StageRecorder:
+    """1ファイルの処理段階ごとの所要時間・ピークRSSと、行数などの件数を記録する"""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.window = memory_sampler.open()
+        self.stages = {}
+        self.counts = {}
+
+    def _add(self, stage):
+        now = time.perf_counter()
+        entry = self.stages.setdefault(stage, {'seconds': 0.0, 'peak_rss_bytes': 0})
+        entry['seconds'] += now - self.last
+        entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'], memory_sampler.peak(self.window))
+        self.last = now
+
+    def record(self, event, **data):
+        """progress の通知を段階の区切りとして記録する"""
+        stage = 'cache' if data.get('cached') else STAGE_EVENTS.get(event)
+        if stage:
+            self._add(stage)
+        for key in STAGE_COUNT_KEYS:
+            if key in data:
+                self.counts[key] = data[key]
+
+    def finish(self):
+        """計測を終えて JSON で返せる要約を返す（最後の通知以降の時間は finalize とする）"""
+        self._add('finalize')
+        memory_sampler.close(self.window)
+        stages = {
+            stage: {'seconds': round(entry['seconds'], 4), 'peak_rss_bytes': entry['peak_rss_bytes']}
+            for stage, entry in self.stages.items()
+        }
+        return {
+            'stages': stages,
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'peak_rss_bytes': max(entry['peak_rss_bytes'] for entry in stages.values()),
+            **self.counts
+        }
+
+# /metrics で公開する累積値（ワーカープロセスごと。worker ラベルにプロセスIDを付けて公開する）
+pipeline_metrics = {
+    'files': {},          # (ジョブ種別, 状態) -> ファイル数
+    'stage_seconds': {},  # (ジョブ種別, 段階) -> [合計秒数, 回数]
+    'stage_peak_rss': {}, # (ジョブ種別, 段階) -> 最大ピークRSS
+    'items': {}           # (ジョブ種別, 件数の種類) -> 合計
+}
+pipeline_metrics_lock = threading.Lock()
+
+def record_pipeline_metrics(job_type, status, summary):
+    """1ファイル分の計測結果を累積値に加える"""
+    with pipeline_metrics_lock:
+        files = pipeline_metrics['files']
+        files[(job_type, status)] = files.get((job_type, status), 0) + 1
+        for stage, entry in summary['stages'].items():
+            key = (job_type, stage)
+            total = pipeline_metrics['stage_seconds'].setdefault(key, [0.0, 0])
+            total[0] += entry['seconds']
+            total[1] += 1
+            peaks = pipeline_metrics['stage_peak_rss']
+            peaks[key] = max(peaks.get(key, 0), entry['peak_rss_bytes'])
+        for kind in STAGE_COUNT_KEYS:
+            if kind in summary:
+                key = (job_type, kind)
+                pipeline_metrics['items'][key] = pipeline_metrics['items'].get(key, 0) + summary[kind]
+
+def prometheus_labels(**labels):
+    """Prometheus のラベル表記（値のバックスラッシュ・引用符・改行はエスケープする）"""
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+def prometheus_metrics():
+    """処理の計測値・ジョブ数・結果キャッシュの統計を Prometheus のテキスト形式で返す
+
+    ディスク上の結果キャッシュの件数・使用量以外はこのワーカープロセスの値で、worker ラベルで区別する。
+    """
+    with pipeline_metrics_lock:
+        files = dict(pipeline_metrics['files'])
+        stage_seconds = {key: list(value) for key, value in pipeline_metrics['stage_seconds'].items()}
+        stage_peak_rss = dict(pipeline_metrics['stage_peak_rss'])
+        items = dict(pipeline_metrics['items'])
+    with result_cache_lock:
+        cache_stats = dict(result_cache_stats)
+    cache_entries = result_cache_entries()
+    with jobs_lock:
+        job_statuses = [job['status'] for job in jobs.values()]
+    worker = os.getpid()
+
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{prometheus_labels(**labels) if labels else ''} {value}")
+
+    metric('co_occurrence_files_processed_total', 'counter', 'Files processed by job type and status.', [
+        ('', {'job_type': job_type, 'status': status, 'worker': worker}, count)
+        for (job_type, status), count in sorted(files.items())
+    ])
+    metric('co_occurrence_stage_duration_seconds', 'summary', 'Time spent in each processing stage.', [
+        sample
+        for (job_type, stage), (seconds, count) in sorted(stage_seconds.items())
+        for sample in (
+            ('_sum', {'job_type': job_type, 'stage': stage, 'worker': worker}, round(seconds, 6)),
+            ('_count', {'job_type': job_type, 'stage': stage, 'worker': worker}, count)
+        )
+    ])
+    metric('co_occurrence_stage_peak_rss_bytes', 'gauge', 'Largest process RSS observed during each stage.', [
+        ('', {'job_type': job_type, 'stage': stage, 'worker': worker}, peak)
+        for (job_type, stage), peak in sorted(stage_peak_rss.items())
+    ])
+    metric('co_occurrence_items_total', 'counter', 'Rows, distinct IDs, campaigns and non-zero pairs processed.', [
+        ('', {'job_type': job_type, 'kind': kind, 'worker': worker}, count)
+        for (job_type, kind), count in sorted(items.items())
+    ])
+    metric('co_occurrence_jobs', 'gauge', 'Jobs currently held in the registry by status.', [
+        ('', {'status': status, 'worker': worker}, job_statuses.count(status))
+        for status in ('queued', 'running', 'completed', 'failed')
+    ])
+    for name in ('hits', 'misses', 'evictions'):
+        metric(f'co_occurrence_result_cache_{name}_total', 'counter', f'Result cache {name}.', [
+            ('', {'worker': worker}, cache_stats[name])
+        ])
+    metric('co_occurrence_result_cache_entries', 'gauge', 'Files in the result cache.', [
+        ('', None, len(cache_entries))
+    ])
+    metric('co_occurrence_result_cache_bytes', 'gauge', 'Bytes used by the result cache.', [
+        ('', None, sum(size for _, size, _ in cache_entries))
+    ])
+    return '\n'.join(lines) + '\n'
+
+# ジョブ管理
+# 処理中・処理済みのジョブ（ジョブID -> ジョブ情報）
+jobs = {}
+jobs_lock = threading.Lock()
+# 完了したジョブを保持する秒数
+JOB_RETENTION_SECONDS = 60 * 60
+
+def prune_jobs():
+    """保持期間を過ぎた完了済みジョブを削除する"""
+    now = time.time()
+    with jobs_lock:
+        expired = [
+            job_id for job_id, job in jobs.items()
+            if job['finished_at'] and now - job['finished_at'] > JOB_RETENTION_SECONDS
+        ]
+        for job_id in expired:
+            del jobs[job_id]
+
+def create_job(job_type, filenames):
+    """ジョブを登録してジョブIDを返す"""
+    prune_jobs()
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {
+            'id': job_id,
+            'type': job_type,
+            'status': 'queued',
+            'created_at': time.time(),
+            'finished_at': None,
+            'errors': [],
+            'files': {
+                filename: {
+                    'status': 'queued',
+                    'stage': None,
+                    'rows': 0,
+                    'output': None,
+                    'error': None,
+                    'metrics': None,
+                    'started_at': None,
+                    'finished_at': None
+                }
+                for filename in filenames
+            }
+        }
+    return job_id
+
+def get_job(job_id):
+    """ジョブ情報のスナップショットを取得する（存在しなければ None）
+
+    このプロセスにないジョブは、他のワーカープロセスが保存したジョブ情報から読み込む。
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            return {**job, 'errors': list(job['errors']), 'files': {k: dict(v) for k, v in job['files'].items()}}
+    return load_job_record(job_id)
+
+def update_job_file(job_id, filename, **fields):
+    """ジョブ内のファイルの状態を更新し、全ファイルが終わればジョブを完了にする"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        job['files'][filename].update(fields)
+        if fields.get('status') == 'running' and job['status'] == 'queued':
+            job['status'] = 'running'
+
+        statuses = [f['status'] for f in job['files'].values()]
+        if all(status in ('completed', 'failed') for status in statuses) and not job['finished_at']:
+            job['finished_at'] = time.time()
+            job['status'] = 'completed' if 'completed' in statuses else 'failed'
+    # 他のワーカープロセスからも参照できるように、状態が変わったときだけ保存する
+    if 'status' in fields:
+        save_job_record(job_id)
+
+def job_outputs(job):
+    """ジョブの出力ファイル名をファイルの登録順に返す（同じ出力は1つにまとめる）"""
+    outputs = []
+    for info in job['files'].values():
+        output = info['output']
+        if output:
+            outputs.extend(output if isinstance(output, list) else [output])
+    return list(dict.fromkeys(outputs))
+
+def job_summary(job):
+    """ジョブの状態をJSONで返せる形式にまとめる"""
+    now = time.time()
+    files = []
+    for filename, info in job['files'].items():
+        elapsed = None
+        if info['started_at']:
+            elapsed = round((info['finished_at'] or now) - info['started_at'], 3)
+        files.append({
+            'filename': filename,
+            'status': info['status'],
+            'stage': info['stage'],
+            'rows': info['rows'],
+            'output': info['output'],
+            'error': info['error'],
+            'elapsed': elapsed,
+            'metrics': info['metrics']
+        })
+    return {
+        'job_id': job['id'],
+        'type': job['type'],
+        'status': job['status'],
+        'elapsed': round((job['finished_at'] or now) - job['created_at'], 3),
+        'files': files,
+        'processed_files': job_outputs(job),
+        # 統合モードでは同じエラーが全ファイルに記録されるため1つにまとめる
+        'errors': list(dict.fromkeys(job['errors'] + [f['error'] for f in files if f['error']]))
+    }
+
+def emit_job_progress(job_id, filename, stage, started_at, **data):
+    """ジョブの購読者に処理段階を Socket.IO で通知する"""
+    socketio.emit('job_progress', {
+        'job_id': job_id,
+        'filename': filename,
+        'stage': stage,
+        'elapsed': round(time.time() - started_at, 3),
+        **data
+    }, to=job_id)
+
+def emit_job_status(job_id):
+    """ジョブ全体の状態を Socket.IO で通知する"""
+    job = get_job(job_id)
+    if job is not None:
+        socketio.emit('job_status', job_summary(job), to=job_id)
+
+def run_job_task(job_id, filenames, task):
+    """ワーカースレッドで task(progress) を実行し、結果を filenames の全ファイルに記録する"""
+    started_at = time.time()
+    for filename in filenames:
+        update_job_file(job_id, filename, status='running', started_at=started_at)
+    recorder = StageRecorder()
+    with jobs_lock:
+        job_type = jobs[job_id]['type']
+    label = ', '.join(filenames)
+
+    def progress(stage, **data):
+        recorder.record(stage, **data)
+        for filename in filenames:
+            update_job_file(job_id, filename, stage=stage, **data)
+            emit_job_progress(job_id, filename, stage, started_at, **data)
+
+    try:
+        result = task(progress)
+        logger.info(f"処理成功: {label} -> {result}")
+        status, fields = 'completed', {'output': result}
+    except Exception as e:
+        error_msg = f"{label}: {str(e)}"
+        logger.error(f"ファイル処理エラー: {error_msg}", exc_info=True)
+        status, fields = 'failed', {'error': error_msg}
+
+    summary = recorder.finish()
+    record_pipeline_metrics(job_type, status, summary)
+    logger.info(f"処理計測: {label} {json.dumps(summary, ensure_ascii=False)}")
+    finished_at = time.time()
+    for filename in filenames:
+        update_job_file(job_id, filename, status=status, metrics=summary, finished_at=finished_at, **fields)
+    emit_job_status(job_id)
+
+def run_job_file(job_id, filename, process_func):
+    """ワーカースレッドで1ファイルを処理し、結果をジョブに記録する（出力はジョブIDの下に置く）"""
+    filepath = upload_filepath(filename)
+    run_job_task(job_id, [filename], lambda progress: process_func(
+        filepath, os.path.basename(filepath), progress=progress, output_prefix=job_id
+    ))
+
+def run_merged_job(job_id, filenames, process_func):
+    """ワーカースレッドで全ファイルを1つの結果に統合し、結果を各ファイルに記録する"""
+    filepaths = [upload_filepath(filename) for filename in filenames]
+    run_job_task(job_id, filenames, lambda progress: process_func(
+        filepaths, [os.path.basename(filepath) for filepath in filepaths], progress=progress, output_prefix=job_id
+    ))
+
+def submit_job(job_type, filenames, process_func, merged=False):
+    """存在するファイルをワーカープールに投入し、(ジョブID, エラー一覧) を返す
+
+    ファイルが1つも存在しない場合はジョブを作らずに (None, エラー一覧) を返す。
+    merged が True なら全ファイルを1つのタスクとして process_func(パス一覧, ファイル名一覧) に渡す。
+    """
+    errors = []
+    targets = []
+    for filename in dict.fromkeys(filenames):
+        filepath = upload_filepath(str(filename))
+        if filepath is None or not os.path.isfile(filepath):
+            error_msg = f"ファイルが見つかりません: {filename}"
+            logger.error(error_msg)
+            errors.append(error_msg)
+            continue
+        targets.append(filename)
+
+    if not targets:
+        return None, errors
+
+    job_id = create_job(job_type, targets)
+    with jobs_lock:
+        jobs[job_id]['errors'] = errors
+    save_job_record(job_id)
+    if merged:
+        executor.submit(run_merged_job, job_id, targets, process_func)
+    else:
+        for filename in targets:
+            executor.submit(run_job_file, job_id, filename, process_func)
+    logger.info(f"ジョブ投入: {job_id} ({job_type}) - {len(targets)}ファイル{'（統合）' if merged else ''}")
+    return job_id, errors
+
+# 共有の成果物ストア
+# アップロードは内容の SHA-256 をキーにしたブロブ（UPLOAD_FOLDER/_blobs）として一時ファイル経由で保存し、
+# ファイル名からハードリンクする（同じ内容の再アップロードはディスクを消費しない）。
+# アップロード名は「<アップロードID>/<ファイル名>」、ジョブの出力ファイル名は「<ジョブID>/<ファイル名>」とし、
+# 別の利用者が同じ名前のファイルをアップロード・処理しても上書きしない。
+# ジョブ情報は ARTIFACT_FOLDER/jobs に JSON で保存し、どのワーカープロセスからも参照できるようにする。
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+# ブロブを作ってからファイル名をリンクするまでの間に削除しないための猶予
+ARTIFACT_BLOB_GRACE_SECONDS = 60
+
+def upload_blob_dir():
+    """アップロード内容のブロブの保存先（UPLOAD_FOLDER 配下）"""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], '_blobs')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def save_upload_stream(stream, block_size=1024 * 1024):
+    """ストリームを一時ファイルに書きながら SHA-256 を計算し、(一時ファイルのパス, SHA-256) を返す"""
+    tmp_path = os.path.join(upload_blob_dir(), f"{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    with open(tmp_path, 'wb') as f:
+        for block in iter(lambda: stream.read(block_size), b''):
+            digest.update(block)
+            f.write(block)
+    return tmp_path, digest.hexdigest()
+
+def artifact_name(prefix, filename):
+    """アップロード名・出力ファイル名（prefix があれば「<prefix>/<ファイル名>」）"""
+    return f"{prefix}/{filename}" if prefix else filename
+
+def upload_filepath(name):
+    """アップロード名に対応するパス（「<アップロードID>/<ファイル名>」の形式でなければ None）"""
+    prefix, _, filename = (name or '').partition('/')
+    if not UPLOAD_ID_PATTERN.match(prefix) or filename != sanitize_filename(filename) or not allowed_file(filename):
+        return None
+    return os.path.join(app.config['UPLOAD_FOLDER'], prefix, filename)
+
+def output_path(name):
+    """出力ファイル名の書き込み先（ジョブIDのディレクトリがなければ作る）"""
+    path = os.path.join(app.config["OUTPUT_FOLDER"], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def store_upload(tmp_path, name, sha256):
+    """受信済みの一時ファイルをブロブとして保存し、アップロード名のパスからリンクする"""
+    blob_path = os.path.join(upload_blob_dir(), sha256)
+    try:
+        # 同じ内容のブロブを再利用する。保持期間の切れた成果物として削除されないよう更新日時を進める
+        os.utime(blob_path)
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        os.replace(tmp_path, blob_path)
+    filepath = upload_filepath(name)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    link_or_copy(blob_path, filepath)
+    save_content_hash(filepath, sha256)
+    return filepath
+
+def job_record_path(job_id):
+    """ジョブ情報の保存先（無効なジョブIDなら None）"""
+    if not JOB_ID_PATTERN.match(job_id or ''):
+        return None
+    path = os.path.join(app.config['ARTIFACT_FOLDER'], 'jobs')
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{job_id}.json")
+
+def save_job_record(job_id):
+    """ジョブ情報を一時ファイル経由で保存する"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        data = json.dumps(job, ensure_ascii=False)
+    path = job_record_path(job_id)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"ジョブ情報の保存に失敗: {job_id} {str(e)}")
+
+def load_job_record(job_id):
+    """保存済みのジョブ情報を読み込む（なければ None）"""
+    path = job_record_path(job_id)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class ArtifactCollector:
+    """保持期間と合計サイズの上限に従って成果物を削除するバックグラウンド処理
+
+    ARTIFACT_GC_INTERVAL_SECONDS ごとに、ARTIFACT_TTL_SECONDS より古いアップロード・出力・
+    ジョブ情報を削除し、合計が ARTIFACT_MAX_BYTES を超えていれば古いものから削除する。
+    どのファイル名からも参照されなくなったブロブも削除する。結果キャッシュ（_cache）と
+    受信中の分割アップロード（_partial）はそれぞれの上限・保持期間で管理するため対象外。
+    複数のワーカープロセスが同時に実行しないように、ファイルロックを取れたプロセスだけが削除する。
+    """
+
+    SKIP_DIRS = ('_cache', '_partial')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """スレッドを開始する（開始済みなら何もしない）"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"成果物の削除に失敗: {str(e)}", exc_info=True)
+            time.sleep(app.config['ARTIFACT_GC_INTERVAL_SECONDS'])
+
+    def entries(self):
+        """(パス, stat) の一覧と、ブロブの inode -> パス、アップロードID・ジョブIDのディレクトリを返す"""
+        roots = [
+            app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'],
+            os.path.join(app.config['ARTIFACT_FOLDER'], 'jobs')
+        ]
+        blob_dir = upload_blob_dir()
+        files, blobs, prefix_dirs = [], {}, []
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [name for name in dirnames if name not in self.SKIP_DIRS]
+                if JOB_ID_PATTERN.match(os.path.basename(dirpath)):
+                    prefix_dirs.append(dirpath)
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if dirpath == blob_dir and not name.endswith('.tmp'):
+                        blobs[stat.st_ino] = (path, stat)
+                    else:
+                        files.append((path, stat))
+        return files, blobs, prefix_dirs
+
+    def collect(self, now=None):
+        """1回分の削除を行い、(削除したファイル数, 解放したバイト数) を返す（他のプロセスが実行中なら None）"""
+        lock_path = os.path.join(app.config['ARTIFACT_FOLDER'], '.gc.lock')
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                return self._collect(now or time.time())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _collect(self, now):
+        ttl = app.config['ARTIFACT_TTL_SECONDS']
+        max_bytes = app.config['ARTIFACT_MAX_BYTES']
+        files, blobs, prefix_dirs = self.entries()
+        removed = freed = 0
+
+        def remove(path):
+            nonlocal removed, freed
+            try:
+                # リンク数は他のファイルの削除で変わるため、削除の直前に取得し直す
+                stat = os.stat(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            removed += 1
+            blob = blobs.get(stat.st_ino)
+            if blob and blob[0] != path and stat.st_nlink <= 2:
+                # ブロブ以外から参照されなくなったブロブも削除する
+                try:
+                    os.remove(blob[0])
+                except FileNotFoundError:
+                    pass
+                del blobs[stat.st_ino]
+                freed += stat.st_size
+            elif not blob and stat.st_nlink == 1:
+                freed += stat.st_size
+
+        # 保持期間を過ぎたもの（書き込み途中で残った一時ファイルを含む）
+        alive = []
+        for path, stat in files:
+            if now - stat.st_mtime > ttl:
+                remove(path)
+            else:
+                alive.append((path, stat))
+
+        # どのファイル名からも参照されていないブロブ
+        for ino, (path, _) in list(blobs.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del blobs[ino]
+                continue
+            if stat.st_nlink == 1 and now - stat.st_ctime > ARTIFACT_BLOB_GRACE_SECONDS:
+                remove(path)
+                del blobs[ino]
+                freed += stat.st_size
+
+        # 合計サイズが上限を超えていれば古い順に削除する（ハードリンクは1回だけ数える）
+        sizes = {stat.st_ino: stat.st_size for _, stat in alive}
+        sizes.update({ino: stat.st_size for ino, (_, stat) in blobs.items()})
+        total = sum(sizes.values())
+        for path, stat in sorted(alive, key=lambda item: item[1].st_mtime):
+            if total <= max_bytes:
+                break
+            if path.endswith('.tmp'):
+                continue
+            before = freed
+            remove(path)
+            total -= freed - before
+
+        # 空になったアップロードID・ジョブIDのディレクトリ（処理中のジョブの出力先は書き込み前でも空なので、
+        # 保持期間を過ぎたものだけ）
+        for path in prefix_dirs:
+            try:
+                if now - os.stat(path).st_mtime > ttl:
+                    os.rmdir(path)
+            except OSError:
+                pass
+
+        if removed:
+            logger.info(f"成果物を削除: {removed}ファイル, {freed}バイト")
+        return removed, freed
+
+artifact_collector = ArtifactCollector()
 
-def get_column_names(df):
-    """必要なカラム名を特定する（改善版）"""
-    id_patterns = ['id', 'ID', '担当者', '見込客']
-    campaign_patterns = ['キャンペーン', 'campaign', 'CAMPAIGN']
-    
-    id_column = None
-    campaign_column = None
-    
-    # カラム名を走査
-    for col in df.columns:
-        col_str = str(col).strip().lower()
-        
-        # ID列の検索
-        if not id_column and any(pattern.lower() in col_str for pattern in id_patterns):
-            id_column = col
-            
-        # キャンペーン列の検索
-        if not campaign_column and any(pattern.lower() in col_str for pattern in campaign_patterns):
-            campaign_column = col
-            
-        # 両方見つかった場合は終了
-        if id_column and campaign_column:
-            break
-            
-    if not id_column or not campaign_column:
-        raise ValueError(f"必要なカラムが見つかりません。\n見つかったカラム: {', '.join(df.columns)}")
-        
-    return id_column, campaign_column
+@app.before_request
+def start_artifact_collector():
+    """最初のリクエストで成果物の削除処理を開始する（CLI などサーバー以外では動かさない）"""
+    artifact_collector.start()
 
-def process_cooccurrence_file(filepath, original_filename):
-    try:
-        # ファイルの拡張子を取得
-        file_ext = original_filename.rsplit('.', 1)[1].lower()
-        
-        # ヘッダー行の特定とデータ読み込み
-        header_row, df = find_header_row(filepath, file_ext)
-        
-        # 必要なカラム名を特定
-        id_column, campaign_column = get_column_names(df)
-        
-        # 必要な列のみを抽出して列名を標準化
-        df_processed = df[[id_column, campaign_column]].copy()
-        df_processed.columns = ["見込客/担当者ID18", "キャンペーン名"]
-
-        # 共起行列の作成
-        co_occurrence_counts = {}
-        for _, group in df_processed.groupby("見込客/担当者ID18"):
-            campaign_names = group["キャンペーン名"].unique()
-            if len(campaign_names) >= 2:
-                for i in range(len(campaign_names)):
-                    for j in range(i + 1, len(campaign_names)):
-                        camp1, camp2 = campaign_names[i], campaign_names[j]
-                        pair = tuple(sorted([camp1, camp2]))
-                        co_occurrence_counts[pair] = co_occurrence_counts.get(pair, 0) + 1
-
-        # ユニークなキャンペーン名を取得
-        unique_campaigns = sorted(df_processed["キャンペーン名"].unique())
-        
-        # 共起行列の作成
-        co_occurrence_matrix = pd.DataFrame(0, 
-                                         index=unique_campaigns, 
-                                         columns=unique_campaigns)
-        
-        # 共起回数を行列に設定
-        for (camp1, camp2), count in co_occurrence_counts.items():
-            co_occurrence_matrix.at[camp1, camp2] = count
-            co_occurrence_matrix.at[camp2, camp1] = count
-
-        # 合計行を追加（1行のみ）
-        sums = co_occurrence_matrix.sum()
-        co_occurrence_matrix.loc['合計'] = sums
-        
-        # 結果ファイルの保存
-        base_name = os.path.splitext(original_filename)[0]
-        output_filename = f"共起行列_{base_name}.{file_ext}"
-        output_filepath = os.path.join(app.config["OUTPUT_FOLDER"], output_filename)
-        
-        # ファイル形式に応じて保存
-        if file_ext == 'xlsx':
-            with pd.ExcelWriter(output_filepath, engine='openpyxl') as writer:
-                co_occurrence_matrix.to_excel(writer, sheet_name='共起行列')
-                
-                # シートの取得と整形
-                worksheet = writer.sheets['共起行列']
-                
-                # 列幅の自動調整
-                for idx, col in enumerate(co_occurrence_matrix.columns):
-                    max_length = max(
-                        co_occurrence_matrix[col].astype(str).apply(len).max(),
-                        len(str(col))
-                    )
-                    worksheet.column_dimensions[get_column_letter(idx + 2)].width = max_length + 2
-
-                # 合計行のスタイル設定
-                last_row = len(co_occurrence_matrix)
-                for col in range(1, len(co_occurrence_matrix.columns) + 2):
-                    cell = worksheet.cell(row=last_row + 1, column=col)
-                    cell.font = Font(bold=True)
-                    cell.fill = PatternFill(start_color='F0F0F0', end_color='F0F0F0', fill_type='solid')
-        else:
-            co_occurrence_matrix.to_csv(output_filepath, encoding='utf-8-sig')
+# 分割アップロード
+# init でセッションを作り、チャンクを順にディスクへ書き込みながら SHA-256 を更新し、finalize で
+# アップロードフォルダに移す。セッション情報は JSON でも保存し、接続が切れた場合は
+# 受信済みのバイト数から再開できる。チャンクは複数のワーカープロセスに届くことがあるため、
+# 受信中のファイルを fcntl でロックし、その大きさを受信済みのバイト数として扱う。
+# upload_sessions はハッシュの途中状態のプロセスごとのキャッシュで、受信中のファイルの大きさと
+# 一致しない場合（他のプロセスが書き込んだ場合など）はハッシュを計算し直す。
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+# 更新のない分割アップロードを保持する秒数
+UPLOAD_SESSION_RETENTION_SECONDS = 24 * 60 * 60
 
-        return output_filename
+def upload_session_dir():
+    """受信中のファイルとセッション情報の保存先（UPLOAD_FOLDER 配下）"""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], '_partial')
+    os.makedirs(path, exist_ok=True)
+    return path
 
-    except Exception as e:
-        logger.error(f"ファイル処理エラー: {str(e)}", exc_info=True)
-        raise
+def upload_session_paths(upload_id):
+    """(受信中のファイル, セッション情報) のパス"""
+    if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+        raise ValueError(f"無効なアップロードIDです: {upload_id}")
+    base = os.path.join(upload_session_dir(), upload_id)
+    return f"{base}.part", f"{base}.json"
+
+def save_upload_session(session_info):
+    """セッション情報（ハッシュの途中状態を除く）を保存する"""
+    _, info_path = upload_session_paths(session_info['id'])
+    data = {key: value for key, value in session_info.items() if key != 'digest'}
+    tmp_path = f"{info_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, info_path)
+
+@contextmanager
+def locked_upload_session(upload_id):
+    """受信中のファイルをロックし、(セッション, 受信中のファイル) を返す（見つからなければ (None, None)）
 
-def process_campaign_file(filepath, original_filename):
-    """キャンペーンファイルの処理（改善版）"""
+    受信済みのバイト数は受信中のファイルの大きさとする。キャッシュしたハッシュの途中状態が
+    それと一致しない場合は、保存済みの情報と受信済みの内容からセッションを作り直す。
+    """
+    part_path, info_path = upload_session_paths(upload_id)
     try:
-        # ファイルの拡張子を取得
-        file_ext = original_filename.rsplit('.', 1)[1].lower()
-        
-        # ファイルの存在確認
-        if not os.path.exists(filepath):
-            raise ValueError(f"ファイルが見つかりません: {filepath}")
-        
-        # ファイルサイズの確認
-        if os.path.getsize(filepath) == 0:
-            raise ValueError("ファイルが空です")
-            
+        f = open(part_path, 'r+b')
+    except FileNotFoundError:
+        yield None, None
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
         try:
-            # ヘッダー行の特定とデータ読み込み
-            header_row, df = find_header_row(filepath, file_ext)
-            logger.info(f"ヘッダー行を特定: {header_row}行目")
-            logger.info(f"検出されたカラム: {', '.join(df.columns)}")
-            
-        except Exception as e:
-            logger.error(f"ヘッダー行の特定に失敗: {str(e)}")
-            raise ValueError(f"データ構造を認識できませんでした。\nエラー: {str(e)}")
-        
-        # 必要なカラム名を特定
+            # ロックを待つ間に確定・削除されたセッションは対象外
+            try:
+                current = os.stat(part_path)
+            except FileNotFoundError:
+                current = None
+            part_stat = os.fstat(f.fileno())
+            if current is None or current.st_ino != part_stat.st_ino:
+                yield None, None
+                return
+
+            with upload_sessions_lock:
+                session_info = upload_sessions.get(upload_id)
+            if session_info is None or session_info['received'] != part_stat.st_size:
+                try:
+                    with open(info_path, encoding='utf-8') as info_file:
+                        session_info = json.load(info_file)
+                except (OSError, ValueError):
+                    yield None, None
+                    return
+                # ハッシュの途中状態は保存できないため、受信済みの内容から計算し直す
+                digest = hashlib.sha256()
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+                session_info.update(received=part_stat.st_size, digest=digest)
+                with upload_sessions_lock:
+                    upload_sessions[upload_id] = session_info
+            yield session_info, f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def get_upload_session(upload_id):
+    """セッションを取得する（受信中のファイルと一致するように必要なら復元する）"""
+    with locked_upload_session(upload_id) as (session_info, _):
+        return session_info
+
+def remove_upload_session(upload_id):
+    """セッションと受信中のファイルを削除する"""
+    with upload_sessions_lock:
+        upload_sessions.pop(upload_id, None)
+    for path in upload_session_paths(upload_id):
         try:
-            id_column, campaign_column = get_column_names(df)
-            logger.info(f"特定されたカラム - ID: {id_column}, キャンペーン: {campaign_column}")
-            
-        except Exception as e:
-            logger.error(f"カラム名の特定に失敗: {str(e)}")
-            raise ValueError(f"必要なカラムが見つかりません。\nエラー: {str(e)}")
-        
-        # キャンペーン名のクリーニング
-        df[campaign_column] = df[campaign_column].apply(clean_campaign_name)
-        
-        # 出力ファイルの準備
-        output_filename = f"cleaned_{sanitize_filename(original_filename)}"
-        output_filepath = os.path.join(app.config["OUTPUT_FOLDER"], output_filename)
-        
-        # ファイルの保存
-        if file_ext == 'csv':
-            df.to_csv(output_filepath, encoding='utf-8-sig', index=False)
-        else:  # xlsx
-            df.to_excel(output_filepath, index=False)
-            
-        logger.info(f"ファイル処理完了: {output_filename}")
-        return output_filename
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-    except Exception as e:
-        logger.error(f"ファイル処理エラー: {str(e)}", exc_info=True)
-        raise
+def prune_upload_sessions():
+    """保持期間を過ぎても完了しない分割アップロードを削除する"""
+    now = time.time()
+    with os.scandir(upload_session_dir()) as it:
+        expired = [
+            entry.name[:-len('.json')] for entry in it
+            if entry.name.endswith('.json') and now - entry.stat().st_mtime > UPLOAD_SESSION_RETENTION_SECONDS
+        ]
+    for upload_id in expired:
+        if UPLOAD_ID_PATTERN.match(upload_id):
+            remove_upload_session(upload_id)
+            logger.info(f"期限切れの分割アップロードを削除: {upload_id}")
+
+def create_upload_session(filename, size, chunk_size=None):
+    """分割アップロードのセッションを作成する"""
+    prune_upload_sessions()
+    upload_id = uuid.uuid4().hex
+    part_path, _ = upload_session_paths(upload_id)
+    session_info = {
+        'id': upload_id,
+        'filename': filename,
+        'size': size,
+        'chunk_size': min(chunk_size or app.config['UPLOAD_CHUNK_BYTES'], app.config['MAX_UPLOAD_CHUNK_BYTES']),
+        'received': 0,
+        'created_at': time.time(),
+        'digest': hashlib.sha256()
+    }
+    # セッション情報を先に保存し、受信中のファイルができた時点で他のプロセスから参照できるようにする
+    save_upload_session(session_info)
+    open(part_path, 'wb').close()
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = session_info
+    return session_info
+
+def append_upload_chunk(upload_id, offset, stream, length, block_size=1024 * 1024):
+    """チャンクをストリームから読みながら受信中のファイルの offset に書き込み、SHA-256 を更新する
+
+    offset は受信済みのバイト数と一致している必要がある。途中で接続が切れた場合も
+    書き込めた分までを受信済みとして記録するため、次のチャンクはそこから再開できる。
+    """
+    with locked_upload_session(upload_id) as (session_info, f):
+        if session_info is None:
+            raise LookupError("アップロードが見つかりません")
+        if offset != session_info['received']:
+            raise ValueError(f"オフセットが一致しません（受信済み: {session_info['received']}）")
+        if offset + length > session_info['size']:
+            raise ValueError("ファイルサイズを超えるチャンクです")
+
+        remaining = length
+        f.seek(offset)
+        try:
+            while remaining > 0:
+                block = stream.read(min(block_size, remaining))
+                if not block:
+                    break
+                f.write(block)
+                session_info['digest'].update(block)
+                session_info['received'] += len(block)
+                remaining -= len(block)
+        finally:
+            f.flush()
+            save_upload_session(session_info)
+        if remaining:
+            raise ValueError(f"チャンクが途中で途切れました（受信済み: {session_info['received']}）")
+        return session_info['received']
+
+def finalize_upload_session(upload_id, expected_sha256=None):
+    """受信が完了したファイルをアップロードフォルダへ移し、(アップロード名, SHA-256) を返す"""
+    part_path, _ = upload_session_paths(upload_id)
+    with locked_upload_session(upload_id) as (session_info, _):
+        if session_info is None:
+            raise LookupError("アップロードが見つかりません")
+        if session_info['received'] != session_info['size']:
+            raise ValueError(
+                f"受信が完了していません（{session_info['received']} / {session_info['size']} バイト）"
+            )
+        sha256 = session_info['digest'].hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise ValueError("ファイルのハッシュが一致しません")
+
+        filename = session_info['filename']
+        name = artifact_name(upload_id, filename)
+        filepath = store_upload(part_path, name, sha256)
+        # ロックを待っている他のリクエストからはセッションが見つからなくなる
+        remove_upload_session(upload_id)
+    store_parse_plan(filepath, filename)
+    return name, sha256
+
+def upload_session_summary(session_info):
+    """セッションの状態をJSONで返せる形式にまとめる"""
+    return {
+        'upload_id': session_info['id'],
+        'filename': session_info['filename'],
+        'size': session_info['size'],
+        'chunk_size': session_info['chunk_size'],
+        'received': session_info['received']
+    }
 
 # ルート定義
 @app.route("/")
@@ -356,13 +2832,18 @@ def upload_file():
         
         files = request.files.getlist('files[]')
         uploaded_files = []
+        # このリクエストのファイルは同じアップロードIDの下に置く
+        upload_id = uuid.uuid4().hex
         
         for file in files:
             if file and allowed_file(file.filename):
                 filename = sanitize_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                uploaded_files.append(filename)
+                name = artifact_name(upload_id, filename)
+                # 一時ファイルに書きながらハッシュを計算し、内容ごとのブロブとして保存する
+                tmp_path, sha256 = save_upload_stream(file.stream)
+                filepath = store_upload(tmp_path, name, sha256)
+                store_parse_plan(filepath, filename)
+                uploaded_files.append(name)
         
         if not uploaded_files:
             return jsonify({
@@ -382,6 +2863,143 @@ def upload_file():
             'error': f'ファイルアップロード中にエラーが発生しました: {str(e)}'
         }), 500
 
+@app.route('/uploads', methods=['POST'])
+def init_upload():
+    """分割アップロードを開始する（JSON: filename, size, chunk_size）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = sanitize_filename(str(data.get('filename', '')))
+        size = data.get('size')
+        chunk_size = data.get('chunk_size')
+        if not filename or not allowed_file(filename):
+            return jsonify({
+                'success': False,
+                'error': '有効なファイルがありません。CSVまたはXLSXファイルを選択してください。'
+            }), 400
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return jsonify({
+                'success': False,
+                'error': 'ファイルサイズが正しくありません'
+            }), 400
+        if size > app.config['MAX_UPLOAD_BYTES']:
+            return jsonify({
+                'success': False,
+                'error': f"ファイルサイズが上限（{app.config['MAX_UPLOAD_BYTES']}バイト）を超えています"
+            }), 400
+        if chunk_size is not None and (not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 1):
+            return jsonify({
+                'success': False,
+                'error': 'チャンクサイズが正しくありません'
+            }), 400
+
+        session_info = create_upload_session(filename, size, chunk_size)
+        logger.info(f"分割アップロード開始: {session_info['id']} {filename} ({size}バイト)")
+        return jsonify({'success': True, **upload_session_summary(session_info)})
+
+    except Exception as e:
+        logger.error(f"アップロードエラー: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': f'ファイルアップロード中にエラーが発生しました: {str(e)}'
+        }), 500
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """分割アップロードの受信済みバイト数を返す（再開時に使う）"""
+    try:
+        session_info = get_upload_session(upload_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if session_info is None:
+        return jsonify({'success': False, 'error': 'アップロードが見つかりません'}), 404
+    return jsonify({'success': True, **upload_session_summary(session_info)})
+
+@app.route('/uploads/<upload_id>/chunks', methods=['PUT'])
+def upload_chunk(upload_id):
+    """チャンクを受信する（クエリ offset、本文はチャンクのバイト列）
+
+    本文は request.stream から読み、メモリに溜めずにディスクへ書き込む。
+    """
+    try:
+        session_info = get_upload_session(upload_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if session_info is None:
+        return jsonify({'success': False, 'error': 'アップロードが見つかりません'}), 404
+
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        return jsonify({
+            'success': False,
+            'error': 'offset と Content-Length が必要です'
+        }), 400
+    if length > app.config['MAX_UPLOAD_CHUNK_BYTES']:
+        return jsonify({
+            'success': False,
+            'error': 'チャンクが大きすぎます',
+            'max_chunk_bytes': app.config['MAX_UPLOAD_CHUNK_BYTES']
+        }), 413
+
+    try:
+        received = append_upload_chunk(upload_id, offset, request.stream, length)
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ClientDisconnected:
+        # 書き込めた分までは受信済みとして記録されている
+        session_info = get_upload_session(upload_id)
+        received = session_info['received'] if session_info else None
+        logger.warning(f"チャンク受信中に切断: {upload_id} (受信済み: {received})")
+        return jsonify({
+            'success': False,
+            'error': 'チャンクの受信中に接続が切れました',
+            'received': received
+        }), 400
+    except ValueError as e:
+        # クライアントは received から送り直す
+        session_info = get_upload_session(upload_id)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'received': session_info['received'] if session_info else None
+        }), 409
+    return jsonify({'success': True, 'received': received})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """受信が完了したファイルを確定する（JSON: sha256 を渡すと内容を照合する）"""
+    try:
+        if get_upload_session(upload_id) is None:
+            return jsonify({'success': False, 'error': 'アップロードが見つかりません'}), 404
+
+        data = request.get_json(silent=True) or {}
+        try:
+            filename, sha256 = finalize_upload_session(upload_id, data.get('sha256'))
+        except LookupError as e:
+            return jsonify({'success': False, 'error': str(e)}), 404
+        except ValueError as e:
+            session_info = get_upload_session(upload_id)
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'received': session_info['received'] if session_info else None
+            }), 409
+        logger.info(f"分割アップロード完了: {upload_id} -> {filename} (sha256={sha256})")
+        return jsonify({
+            'success': True,
+            'files': [filename],
+            'sha256': sha256
+        })
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"アップロードエラー: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': f'ファイルアップロード中にエラーが発生しました: {str(e)}'
+        }), 500
+
 @app.route('/process_cooccurrence', methods=['POST'])
 def process_cooccurrence_files():
     """共起行列生成処理のエンドポイント"""
@@ -407,48 +3025,41 @@ def process_cooccurrence_files():
                 'error': '処理するファイルがありません'
             }), 400
 
-        # 処理結果の追跡
-        output_files = []
-        errors = []
-
-        # 各ファイルを処理
-        for filename in filenames:
-            try:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if not os.path.exists(filepath):
-                    errors.append(f"ファイルが見つかりません: {filename}")
-                    continue
-
-                result = process_cooccurrence_file(filepath, filename)
-                if result:
-                    output_files.append(result)
-                    logger.info(f"処理成功: {filename} -> {result}")
+        try:
+            options = parse_cooccurrence_options(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
 
-            except Exception as e:
-                error_msg = f"{filename}: {str(e)}"
-                logger.error(f"ファイル処理エラー: {error_msg}", exc_info=True)
-                errors.append(error_msg)
+        # ワーカープールにジョブを投入し、すぐにジョブIDを返す
+        # 統合モードでは全ファイルをIDで統合して1つの共起行列を作る（常にチャンクごとに読み込む）
+        merge = bool(data.get('merge'))
+        if merge:
+            options.pop('streaming')
+            process_func = partial(process_merged_cooccurrence_files, **options)
+        else:
+            process_func = partial(process_cooccurrence_file, **options)
+        job_id, errors = submit_job('cooccurrence', filenames, process_func, merged=merge)
 
-        # 処理結果の確認と応答の生成
-        if not output_files and errors:
+        if not job_id:
             return jsonify({
                 'success': False,
                 'error': '全てのファイルの処理に失敗しました',
                 'errors': errors
             }), 400
 
-        # セッションに結果を保存
-        session['output_files'] = output_files
-        
         response_data = {
             'success': True,
-            'redirect': url_for('complete_cooccurrence'),
-            'processed_files': output_files
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'redirect': url_for('complete_cooccurrence', job_id=job_id)
         }
         if errors:
             response_data['warnings'] = errors
 
-        logger.info(f"処理完了 - レスポンス: {response_data}")
+        logger.info(f"ジョブ受付 - レスポンス: {response_data}")
         return jsonify(response_data)
 
     except Exception as e:
@@ -488,56 +3099,26 @@ def process_campaign_files():
                 'error': '処理するファイルがありません'
             }), 400
 
-        # 処理結果の追跡
-        output_files = []
-        errors = []
-
-        # 各ファイルを処理
-        for filename in filenames:
-            try:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                # ファイルの存在確認
-                if not os.path.exists(filepath):
-                    error_msg = f"ファイルが見つかりません: {filename}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-                    continue
-
-                # ファイルの処理
-                logger.info(f"Processing file: {filename}")
-                result = process_campaign_file(filepath, filename)
-                
-                if result:
-                    output_files.append(result)
-                    logger.info(f"Successfully processed: {filename} -> {result}")
-
-            except Exception as e:
-                error_msg = f"{filename}: {str(e)}"
-                logger.error(f"File processing error: {error_msg}")
-                logger.error(traceback.format_exc())  # スタックトレースを出力
-                errors.append(error_msg)
+        # ワーカープールにジョブを投入し、すぐにジョブIDを返す
+        job_id, errors = submit_job('campaign', filenames, process_campaign_file)
 
-        # 処理結果の確認
-        if not output_files and errors:
+        if not job_id:
             return jsonify({
                 'success': False,
                 'error': '全てのファイルの処理に失敗しました',
                 'errors': errors
             }), 400
 
-        # セッションに結果を保存
-        session['output_files'] = output_files
-        
         response_data = {
             'success': True,
-            'redirect': url_for('complete_campaign'),
-            'processed_files': output_files
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'redirect': url_for('complete_campaign', job_id=job_id)
         }
         if errors:
             response_data['warnings'] = errors
 
-        logger.info(f"Processing complete - Response: {response_data}")
+        logger.info(f"Job submitted - Response: {response_data}")
         return jsonify(response_data)
 
     except Exception as e:
@@ -549,44 +3130,367 @@ def process_campaign_files():
             'error': error_msg
         }), 500
 
+@app.route('/states/<state_name>/merge', methods=['POST'])
+def merge_state_files(state_name):
+    """差分ファイルを共起状態にマージするエンドポイント"""
+    try:
+        if not request.is_json:
+            return jsonify({
+                'success': False,
+                'error': '無効なリクエスト形式です'
+            }), 400
+
+        data = request.get_json()
+        filenames = (data or {}).get('files')
+        if not filenames:
+            return jsonify({
+                'success': False,
+                'error': '処理するファイルがありません'
+            }), 400
+
+        try:
+            cooccurrence_state_path(state_name)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+
+        # 同じ状態へのマージはロックで直列化される
+        job_id, errors = submit_job('merge', filenames, partial(process_delta_file, state_name=state_name))
+
+        if not job_id:
+            return jsonify({
+                'success': False,
+                'error': '全てのファイルの処理に失敗しました',
+                'errors': errors
+            }), 400
+
+        response_data = {
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'redirect': url_for('complete_cooccurrence', job_id=job_id)
+        }
+        if errors:
+            response_data['warnings'] = errors
+        return jsonify(response_data)
+
+    except Exception as e:
+        logger.error(f"予期せぬエラー: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': f'予期せぬエラーが発生しました: {str(e)}'
+        }), 500
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """ジョブの進捗（ファイルごとの状態・処理行数・経過時間）を返す"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'ジョブが見つかりません'
+        }), 404
+    return jsonify({'success': True, **job_summary(job)})
+
+@socketio.on('subscribe')
+def subscribe_job(data):
+    """クライアントをジョブのルームに参加させ、現在の状態を送る"""
+    job = get_job((data or {}).get('job_id', ''))
+    if job is None:
+        emit('job_error', {'error': 'ジョブが見つかりません'})
+        return
+    join_room(job['id'])
+    emit('job_status', job_summary(job))
+
+@app.route("/cache/stats")
+def cache_stats():
+    """結果キャッシュのヒット・ミス数と使用量を返す
+
+    ヒット・ミス・削除の回数は応答したワーカープロセス（worker）の値、件数・使用量はキャッシュ全体の値。
+    """
+    entries = result_cache_entries()
+    with result_cache_lock:
+        stats = dict(result_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    return jsonify({
+        'success': True,
+        **stats,
+        'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None,
+        'worker': os.getpid(),
+        'entries': len(entries),
+        'bytes': sum(size for _, size, _ in entries),
+        'max_bytes': app.config['RESULT_CACHE_MAX_BYTES']
+    })
+
+@app.route("/metrics")
+def metrics():
+    """処理段階の計測値・ジョブ数・結果キャッシュの統計を Prometheus 形式で返す"""
+    response = make_response(prometheus_metrics())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+def query_int(name, default, maximum=None):
+    """クエリ文字列の0以上の整数を取得する（不正な値は ValueError）"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    if not value.isdigit():
+        raise ValueError(f"{name} は0以上の整数で指定してください")
+    value = int(value)
+    return min(value, maximum) if maximum is not None else value
+
+def matrix_query(query):
+    """照会を実行して JSON を返す（名前・キャンペーンがなければ 404、引数が不正なら 400）"""
+    try:
+        return jsonify({'success': True, **query()})
+    except KeyError as e:
+        return jsonify({'success': False, 'error': e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route("/matrices/<path:name>")
+def matrix_info(name):
+    """共起行列の概要とキャンペーン名（offset / limit でページ分割）"""
+    def query():
+        index = load_matrix_index(name)
+        offset = query_int('offset', 0)
+        limit = query_int('limit', MATRIX_QUERY_MAX_LIMIT, MATRIX_QUERY_MAX_LIMIT)
+        return {
+            'name': name,
+            'campaigns': len(index.labels),
+            'total_ids': index.total_ids,
+            'pairs': int(index.counts.nnz // 2),
+            'labels': index.labels[offset:offset + limit]
+        }
+    return matrix_query(query)
+
+@app.route("/matrices/<path:name>/row")
+def matrix_row(name):
+    """1キャンペーンの行を共起回数の多い順に返す（?campaign=名前&offset=&limit=）"""
+    def query():
+        campaign = request.args.get('campaign')
+        if not campaign:
+            raise ValueError("campaign を指定してください")
+        offset = query_int('offset', 0)
+        limit = query_int('limit', 50, MATRIX_QUERY_MAX_LIMIT)
+        return {'offset': offset, 'limit': limit, **load_matrix_index(name).row(campaign, offset, limit)}
+    return matrix_query(query)
+
+@app.route("/matrices/<path:name>/submatrix")
+def matrix_submatrix(name):
+    """指定したキャンペーン同士の部分行列を返す（?campaign=名前 を繰り返す）"""
+    def query():
+        campaigns = list(dict.fromkeys(request.args.getlist('campaign')))
+        if not campaigns:
+            raise ValueError("campaign を指定してください")
+        if len(campaigns) > MATRIX_QUERY_MAX_CAMPAIGNS:
+            raise ValueError(f"一度に指定できるキャンペーンは{MATRIX_QUERY_MAX_CAMPAIGNS}件までです")
+        return load_matrix_index(name).submatrix(campaigns)
+    return matrix_query(query)
+
+@app.route("/matrices/<path:name>/pairs")
+def matrix_pairs(name):
+    """共起回数の多い順のペアを返す（?offset=&limit=&min_count=）"""
+    def query():
+        offset = query_int('offset', 0)
+        limit = query_int('limit', 50, MATRIX_QUERY_MAX_LIMIT)
+        min_count = query_int('min_count', None)
+        return {'offset': offset, 'limit': limit, **load_matrix_index(name).top_pairs(offset, limit, min_count)}
+    return matrix_query(query)
+
+# 完了ページのプレビューに表示する上位ペアの件数
+MATRIX_PREVIEW_PAIRS = 10
+
+def matrix_previews(output_files):
+    """照会用インデックスがある出力ファイルについて、完了ページのプレビューを作る"""
+    previews = []
+    for name in output_files:
+        try:
+            index = load_matrix_index(name)
+        except (KeyError, ValueError):
+            continue
+        previews.append({
+            'name': name,
+            'campaigns': len(index.labels),
+            'total_ids': index.total_ids,
+            'top_pairs': index.top_pairs(0, MATRIX_PREVIEW_PAIRS)['items']
+        })
+    return previews
+
 @app.route("/complete_cooccurrence")
 def complete_cooccurrence():
     """共起行列生成完了ページ"""
-    output_files = session.get('output_files', [])
+    job = get_job(request.args.get('job_id', ''))
+    output_files = job_outputs(job) if job else []
     return render_template(
         "complete_top.html", 
         output_files=output_files,
-        file_count=len(output_files)
+        file_count=len(output_files),
+        job_id=job['id'] if job else None,
+        previews=matrix_previews(output_files)
     )
 
 @app.route("/complete_campaign")
 def complete_campaign():
     """キャンペーン名クリーニング完了ページ"""
-    output_files = session.get('output_files', [])
-    return render_template("complete_second.html", output_files=output_files)
+    job = get_job(request.args.get('job_id', ''))
+    output_files = job_outputs(job) if job else []
+    return render_template(
+        "complete_second.html",
+        output_files=output_files,
+        job_id=job['id'] if job else None
+    )
+
+def output_filepath(filename):
+    """出力フォルダ内のファイルのパス（フォルダの外を指す場合や存在しない場合は None）"""
+    filepath = safe_join(app.config["OUTPUT_FOLDER"], filename)
+    if filepath is None or not os.path.isfile(filepath):
+        return None
+    return filepath
+
+def negotiate_encoding(accept_encoding):
+    """Accept-Encoding から使用する圧縮方式（zstd / gzip / None）を選ぶ
+
+    q値が同じなら zstd を優先し、q=0 の方式は使わない。
+    """
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    candidates = [
+        (qualities.get(encoding, qualities.get('*', 0.0)), -rank, encoding)
+        for rank, encoding in enumerate(('zstd', 'gzip'))
+    ]
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+def compressed_chunks(filepath, encoding, block_size=DOWNLOAD_BLOCK_BYTES):
+    """ファイルをブロックごとに読みながら圧縮して返す（全体をメモリに載せない）"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 で gzip 形式
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            chunk = compressor.compress(block)
+            if chunk:
+                yield chunk
+    yield compressor.flush()
+
+class ZipStreamBuffer:
+    """ZipFile の書き込み先（シークできないストリームとして書かれた分を取り出す）"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_chunks(filepaths, block_size=DOWNLOAD_BLOCK_BYTES):
+    """複数のファイルを zip にまとめながら少しずつ返す
+
+    書き込み先をシークできないため、各エントリのサイズとCRCはデータの後ろに書かれる。
+    圧縮済みの形式は無圧縮で格納する。
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for arcname, filepath in filepaths:
+            file_ext = arcname.rsplit('.', 1)[-1].lower()
+            compress_type = zipfile.ZIP_STORED if file_ext in PRECOMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo.from_file(filepath, arcname)
+            info.compress_type = compress_type
+            with open(filepath, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dst:
+                for block in iter(lambda: src.read(block_size), b''):
+                    dst.write(block)
+                    data = buffer.take()
+                    if data:
+                        yield data
+            yield buffer.take()
+    yield buffer.take()
+
+def attachment_headers(filename):
+    """日本語のファイル名でも保存できる Content-Disposition"""
+    return {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+
+@app.route("/download_bundle/<job_id>")
+def download_bundle(job_id):
+    """ジョブの全出力ファイルを1つの zip として少しずつ作りながら返す"""
+    job = get_job(job_id)
+    if job is None:
+        return "ジョブが見つかりません", 404
+    filepaths = [
+        (os.path.basename(filename), filepath)
+        for filename in job_outputs(job)
+        if (filepath := output_filepath(filename)) is not None
+    ]
+    if not filepaths:
+        return "ファイルが見つかりません", 404
+
+    bundle_name = f"処理結果_{job_id[:8]}.zip"
+    logger.info(f"一括ダウンロード: {job_id} ({len(filepaths)}ファイル)")
+    return app.response_class(
+        zip_chunks(filepaths),
+        mimetype='application/zip',
+        headers=attachment_headers(bundle_name)
+    )
 
 @app.route("/download/<path:filename>")
 def download_file(filename):
+    """出力ファイルのダウンロード
+
+    Accept-Encoding で zstd / gzip を受け付けるクライアントには、圧縮済みの形式を除き
+    ファイルを少しずつ読みながら圧縮して返す。
+    """
     try:
-        filepath = os.path.join(app.config["OUTPUT_FOLDER"], filename)
-        if not os.path.exists(filepath):
+        filepath = output_filepath(filename)
+        if filepath is None:
             return "ファイルが見つかりません", 404
 
         # ファイルの種類に応じてMIMEタイプを設定
         file_ext = filename.rsplit('.', 1)[1].lower()
-        if file_ext == 'xlsx':
-            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        else:
-            mimetype = 'text/csv;charset=utf-8'
+        mimetype = OUTPUT_MIMETYPES.get(file_ext, 'application/octet-stream')
+        download_name = os.path.basename(filepath)
+
+        encoding = None
+        if file_ext not in PRECOMPRESSED_EXTENSIONS:
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding:
+            response = app.response_class(
+                compressed_chunks(filepath, encoding),
+                mimetype=mimetype,
+                headers={**attachment_headers(download_name), 'Content-Encoding': encoding}
+            )
+            response.vary.add('Accept-Encoding')
+            return response
 
         response = send_file(
             filepath,
             as_attachment=True,
             mimetype=mimetype,
-            download_name=filename
+            download_name=download_name
         )
-        response.headers["Content-Disposition"] = \
-            f"attachment; filename*=UTF-8''{quote(filename)}"
+        response.headers.update(attachment_headers(download_name))
+        if file_ext not in PRECOMPRESSED_EXTENSIONS:
+            response.vary.add('Accept-Encoding')
         
         return response
 
@@ -613,5 +3517,14 @@ def handle_exception(e):
     }), 500
 
 
+@app.cli.command('merge-delta')
+@click.argument('state_name')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def merge_delta_command(state_name, paths):
+    """差分ファイルを共起状態 STATE_NAME にマージし、共起行列を出力する"""
+    for path in paths:
+        output_filename = process_delta_file(path, os.path.basename(path), state_name=state_name)
+        click.echo(os.path.join(app.config['OUTPUT_FOLDER'], output_filename))
+
 if __name__ == "__main__":
-    app.run(debug=False)
+    socketio.run(app, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,88 @@
+"""キャンペーン名クリーニングのベンチマーク
+
+合成したキャンペーン名の列に対して、従来の行ごとに5つの正規表現を適用する
+apply(original_clean_campaign_name) とユニーク値だけを処理する clean_campaign_names を比較する。
+キャンペーン名のメモは一時ファイルに作るため、毎回メモなしの状態から計測する。
+
+    python benchmarks/bench_campaign_cleaning.py --rows 1000000 --campaigns 2000
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as application  # noqa: E402
+
+# Salesforce のエクスポートで見られるキャンペーン名の接頭辞
+PREFIXES = ['', '2024/', '2024／', '12 / ', '2024/04/', '／', '01 02 / ']
+
+
+def original_clean_campaign_name(campaign_name):
+    """書き換え前の clean_campaign_name（5つのパターンを行ごとに順に適用する）"""
+    if pd.isna(campaign_name):
+        return campaign_name
+
+    campaign_name = str(campaign_name)
+    patterns = [
+        r'^\d+[/／]',
+        r'^\d+\s*[/／]',
+        r'^[\d\s/／]+',
+        r'^[/／]+',
+        r'^\d+[/／]\d+[/／]',
+    ]
+
+    cleaned = campaign_name
+    for pattern in patterns:
+        cleaned = re.sub(pattern, '', cleaned)
+
+    cleaned = re.sub(r'^[/／]+', '', cleaned)
+    cleaned = cleaned.strip()
+
+    return cleaned
+
+
+def generate(rows, campaigns, seed=0):
+    """接頭辞付きのキャンペーン名と欠損値を含む列を作成する"""
+    rng = np.random.default_rng(seed)
+    names = np.array(
+        [f"{PREFIXES[i % len(PREFIXES)]}キャンペーン{i} " for i in range(campaigns)] + [None],
+        dtype=object
+    )
+    return pd.Series(names[rng.integers(0, len(names), rows)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--campaigns', type=int, default=2_000)
+    args = parser.parse_args()
+
+    campaigns = generate(args.rows, args.campaigns)
+    print(f"rows={args.rows} campaigns={args.campaigns}")
+
+    start = time.perf_counter()
+    expected = campaigns.apply(original_clean_campaign_name)
+    apply_time = time.perf_counter() - start
+    print(f"     apply: {apply_time:8.3f}s")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # サーバーの既定のメモを読み書きしない（2回目以降の実行がメモありの計測にならないように）
+        application.app.config['CAMPAIGN_MEMO_PATH'] = os.path.join(tmpdir, 'memo.json')
+        start = time.perf_counter()
+        result = application.clean_campaign_names(campaigns)
+        vectorized_time = time.perf_counter() - start
+    print(f"vectorized: {vectorized_time:8.3f}s  speedup={apply_time / vectorized_time:6.1f}x")
+
+    if expected.to_csv(index=False) != result.to_csv(index=False):
+        raise AssertionError("2つの方法の結果が一致しません")
+
+
+if __name__ == '__main__':
+    main()
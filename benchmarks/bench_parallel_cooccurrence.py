@@ -0,0 +1,77 @@
+"""共起回数計算の並列化ベンチマーク
+
+合成データに対して build_cooccurrence_counts を1〜Nプロセスで実行し、
+所要時間と1プロセスに対する速度向上率を表示する。プロセス数は各シャードが COUNT_BLOCK_IDS 件以上の
+IDを持つように減らされるため、--ids の既定値は --max-workers のプロセスを全て使える数にする。
+それでも減らされる（effective が workers より少ない）場合は計測せずに表示だけする。
+計測の前に1回実行し、読み込みなどの初回のコストを速度向上率に含めない。
+
+    python benchmarks/bench_parallel_cooccurrence.py --max-workers 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import COUNT_BLOCK_IDS, build_cooccurrence_counts, effective_count_workers  # noqa: E402
+
+
+def generate(rows, ids, campaigns, seed=0):
+    """ID列とキャンペーン列の合成データを作成する"""
+    rng = np.random.default_rng(seed)
+    id_values = pd.Series([f"00Q{i:015d}" for i in rng.integers(0, ids, rows)])
+    campaign_values = pd.Series([f"キャンペーン{i}" for i in rng.integers(0, campaigns, rows)])
+    return id_values, campaign_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, help='行数（既定: IDの数の4倍）')
+    parser.add_argument('--ids', type=int, help='IDの数（既定: max-workers × COUNT_BLOCK_IDS）')
+    parser.add_argument('--campaigns', type=int, default=1_000)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    # 合成データは重複を含むため、ユニークなIDが足りるように少し多めにする
+    args.ids = args.ids or int(args.max_workers * COUNT_BLOCK_IDS * 1.1)
+    args.rows = args.rows or 4 * args.ids
+
+    ids, campaigns = generate(args.rows, args.ids, args.campaigns)
+    print(f"rows={args.rows} ids={args.ids} campaigns={args.campaigns}")
+    n_ids = ids.nunique()
+
+    # 初回のコストを計測に含めない
+    build_cooccurrence_counts(ids, campaigns, workers=1)
+
+    worker_counts = sorted({1, *[2 ** i for i in range(1, args.max_workers.bit_length())], args.max_workers})
+    baseline = None
+    expected = None
+    for workers in worker_counts:
+        effective = effective_count_workers(n_ids, workers)
+        if effective < workers:
+            print(f"workers={workers:>3}  effective={effective:>3}  skipped（IDが足りません: --ids を増やしてください）")
+            continue
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            counts = build_cooccurrence_counts(ids, campaigns, workers=workers)[0]
+            timings.append(time.perf_counter() - start)
+
+        # 並列化しても結果が変わらないことを確認
+        if expected is None:
+            expected = counts
+        elif (counts != expected).nnz:
+            raise AssertionError(f"workers={workers} の結果が1プロセスの結果と一致しません")
+
+        best = min(timings)
+        baseline = baseline or best
+        print(f"workers={workers:>3}  effective={effective:>3}  best={best:8.3f}s  speedup={baseline / best:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""共起行列・クリーニングのパイプライン全体のベンチマーク
+
+synthetic.py で作成した合成エクスポートに対して、アプリと同じ関数で
+detect（ヘッダー・列の検出）, parse（読み込み）, clean（キャンペーン名の整形）,
+count（共起回数）, assemble（合計行付きの行列）, write（出力）を段階ごとに計測し、
+各段階の所要時間とピークRSSをJSONに保存する。形式・エンコーディングの組み合わせごとに実行する。
+計測するのは全列を読み込む通常の経路（process_campaign_file などと同じ）で、
+xlsx のストリーミング集計は bench_xlsx_ingest.py で計測する。
+
+    python benchmarks/bench_pipeline.py --rows 1000000 --formats csv xlsx --encodings utf-8 cp932 \\
+        --output results.json
+    python benchmarks/bench_pipeline.py --rows 1000000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as application  # noqa: E402
+from app import (  # noqa: E402
+    build_cooccurrence_counts, clean_campaign_names, detect_parse_plan, read_with_parse_plan,
+    to_cooccurrence_frame, write_cooccurrence_xlsx, write_table
+)
+from synthetic import add_arguments, write_export  # noqa: E402
+
+STAGES = ['detect', 'parse', 'clean', 'count', 'assemble', 'write']
+
+
+def current_rss():
+    """現在のRSS（バイト）。/proc がなければプロセスのピークRSSで代用する"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMeter:
+    """段階ごとの所要時間と、実行中に別スレッドで採取したピークRSSを記録する"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stages = {}
+
+    def run(self, name, func, *args, **kwargs):
+        peak = [current_rss()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], current_rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            done.set()
+            sampler.join()
+            peak[0] = max(peak[0], current_rss())
+            self.stages[name] = {'seconds': round(seconds, 4), 'peak_rss_mb': round(peak[0] / 2**20, 1)}
+
+
+def assemble(counts, unique_campaigns):
+    """write_cooccurrence_result と同じく合計行付きの行列を作る"""
+    matrix = to_cooccurrence_frame(counts, unique_campaigns)
+    matrix.loc['合計'] = matrix.sum()
+    return matrix
+
+
+def write(matrix, path, file_format):
+    if file_format == 'xlsx':
+        write_cooccurrence_xlsx(path, matrix)
+    else:
+        write_table(matrix, path, file_format, index=True)
+
+
+def run_pipeline(path, file_format, output_path):
+    """1ファイル分のパイプラインを段階ごとに計測する"""
+    # クリーニングのメモは毎回空の状態から計測する
+    application.campaign_memo = {}
+    meter = StageMeter()
+
+    plan = meter.run('detect', detect_parse_plan, path, file_format)
+    df = meter.run('parse', read_with_parse_plan, path, plan)
+    ids, campaigns = df[plan['id_column']], df[plan['campaign_column']]
+    campaigns = meter.run('clean', clean_campaign_names, campaigns)
+    counts, unique_campaigns, _, total_ids = meter.run('count', build_cooccurrence_counts, ids, campaigns)
+    matrix = meter.run('assemble', assemble, counts, unique_campaigns)
+    meter.run('write', write, matrix, output_path, file_format)
+
+    return {
+        'header_row': plan['header_row'],
+        'encoding': plan['encoding'],
+        'rows': len(df),
+        'ids': total_ids,
+        'campaigns': len(unique_campaigns),
+        'pairs': int(counts.nnz // 2),
+        'stages': meter.stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in meter.stages.values()), 4),
+        'output_bytes': os.path.getsize(output_path)
+    }
+
+
+def environment():
+    """比較のために実行環境を記録する"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit
+    }
+
+
+def case_name(file_format, encoding):
+    return file_format if file_format == 'xlsx' else f"{file_format}-{encoding}"
+
+
+def compare(results, baseline):
+    """前回の結果と段階ごとの所要時間・ピークRSSを比較して表示する"""
+    if baseline.get('params') != results['params']:
+        print(f"注意: 生成パラメータが異なります（前回 {baseline.get('params')}）")
+    for name, case in results['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if not previous:
+            continue
+        print(f"[{name}] 前回 {baseline.get('environment', {}).get('commit')} との比較")
+        for stage in STAGES + ['total']:
+            if stage == 'total':
+                now, before = case['total_seconds'], previous['total_seconds']
+                rss_now = rss_before = None
+            else:
+                now, before = case['stages'][stage]['seconds'], previous['stages'][stage]['seconds']
+                rss_now = case['stages'][stage]['peak_rss_mb']
+                rss_before = previous['stages'][stage]['peak_rss_mb']
+            ratio = now / before if before else float('inf')
+            line = f"  {stage:>8}: {before:8.3f}s -> {now:8.3f}s ({ratio:5.2f}x)"
+            if rss_now is not None:
+                line += f"  RSS {rss_before:8.1f}MB -> {rss_now:8.1f}MB"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'xlsx'], default=['csv'])
+    parser.add_argument('--encodings', nargs='+', choices=['utf-8', 'cp932'], default=['utf-8'])
+    parser.add_argument('--repeat', type=int, default=1, help='各ケースの実行回数（合計時間が最小の回を記録）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する前回の結果JSONファイル')
+    args = parser.parse_args()
+
+    params = {
+        'rows': args.rows, 'ids': args.ids, 'campaigns': args.campaigns, 'skew': args.skew,
+        'header_offset': args.header_offset, 'seed': args.seed
+    }
+    results = {'params': params, 'environment': environment(), 'cases': {}}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        application.app.config['CAMPAIGN_MEMO_PATH'] = os.path.join(tmpdir, 'memo.json')
+        cases = dict.fromkeys(
+            (file_format, 'utf-8' if file_format == 'xlsx' else encoding)
+            for file_format in args.formats for encoding in args.encodings
+        )
+        for file_format, encoding in cases:
+            name = case_name(file_format, encoding)
+            path = os.path.join(tmpdir, f"input_{name}.{file_format}")
+            start = time.perf_counter()
+            write_export(
+                path, args.rows, args.ids, args.campaigns, args.skew, args.header_offset,
+                encoding, file_format, args.seed
+            )
+            print(f"[{name}] size={os.path.getsize(path) / 1e6:.1f}MB (生成 {time.perf_counter() - start:.1f}s)")
+
+            runs = [
+                run_pipeline(path, file_format, os.path.join(tmpdir, f"output_{name}.{file_format}"))
+                for _ in range(args.repeat)
+            ]
+            case = min(runs, key=lambda run: run['total_seconds'])
+            case['peak_rss_mb'] = max(stage['peak_rss_mb'] for stage in case['stages'].values())
+            results['cases'][name] = case
+            for stage in STAGES:
+                print(f"  {stage:>8}: {case['stages'][stage]['seconds']:8.3f}s  "
+                      f"RSS {case['stages'][stage]['peak_rss_mb']:8.1f}MB")
+            print(f"  {'total':>8}: {case['total_seconds']:8.3f}s  "
+                  f"ids={case['ids']} campaigns={case['campaigns']} pairs={case['pairs']}")
+
+    results['process_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""xlsx読み込みのベンチマーク
+
+合成ワークブックに対して、従来の経路（find_header_row で pandas/openpyxl により
+全列を読み込み build_cooccurrence_counts）と、read_only モードでID列・キャンペーン列だけを
+読む stream_xlsx_cooccurrence_counts の所要時間を比較する。
+
+    python benchmarks/bench_xlsx_ingest.py --rows 500000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import build_cooccurrence_counts, find_header_row, stream_xlsx_cooccurrence_counts  # noqa: E402
+
+
+def write_workbook(path, rows, ids, campaigns, header_offset=3, seed=0):
+    """前置き行のあとにヘッダーとデータ行を持つ合成ワークブックを作成する"""
+    rng = np.random.default_rng(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('レポート')
+    for i in range(header_offset):
+        worksheet.append([f"前置き{i}"])
+    worksheet.append(['氏名', '見込客/担当者ID18', 'キャンペーン名', 'メンバーステータス'])
+    for id_code, campaign_code in zip(rng.integers(0, ids, rows), rng.integers(0, campaigns, rows)):
+        worksheet.append([f"氏名{id_code}", f"00Q{id_code:015d}", f"キャンペーン{campaign_code}", '送信済み'])
+    workbook.save(path)
+
+
+def pandas_path(path):
+    header_row, df = find_header_row(path, 'xlsx')
+    return build_cooccurrence_counts(df['見込客/担当者ID18'], df['キャンペーン名'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--ids', type=int, default=100_000)
+    parser.add_argument('--campaigns', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.xlsx')
+        start = time.perf_counter()
+        write_workbook(path, args.rows, args.ids, args.campaigns)
+        print(f"rows={args.rows} size={os.path.getsize(path) / 1e6:.1f}MB "
+              f"(生成 {time.perf_counter() - start:.1f}s)")
+
+        results = {}
+        for name, func in [('pandas', pandas_path), ('read_only', stream_xlsx_cooccurrence_counts)]:
+            start = time.perf_counter()
+            results[name] = func(path)
+            print(f"{name:>10}: {time.perf_counter() - start:8.2f}s")
+
+        counts_a, labels_a, support_a, _ = results['pandas']
+        counts_b, labels_b, support_b, _ = results['read_only']
+        if labels_a != labels_b or (counts_a != counts_b).nnz or (support_a != support_b).any():
+            raise AssertionError("2つの経路の結果が一致しません")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""ベンチマーク用の合成エクスポートファイル生成
+
+Salesforce のキャンペーンメンバーのエクスポートを模したCSV / xlsxを作成する。
+行数・ID数・キャンペーン数・IDあたりのキャンペーン数の偏り・ヘッダー前の行数・
+エンコーディング（utf-8 / cp932）・形式（csv / xlsx）を指定できる。
+
+    python benchmarks/synthetic.py out.csv --rows 1000000 --ids 200000 --campaigns 2000 --skew 1.0
+"""
+import argparse
+import csv
+
+import numpy as np
+import openpyxl
+
+# 元データ整形ツールのクリーニング対象になる接頭辞
+PREFIXES = ['', '2024/', '2024／', '12 / ', '2024/04/', '／', '01 02 / ']
+HEADER = ['氏名', '見込客/担当者ID18', 'キャンペーン名', 'メンバーステータス']
+STATUSES = ['送信済み', '開封済み', 'クリック済み', '参加']
+
+
+def generate_rows(rows, ids, campaigns, skew=0.0, seed=0):
+    """(ID番号, キャンペーン番号) の配列を作成する
+
+    skew はIDの出現確率を順位の -skew 乗に比例させる指数で、0 なら一様、
+    大きいほど少数のIDに多くのキャンペーンが集中する。
+    """
+    rng = np.random.default_rng(seed)
+    if skew > 0:
+        weights = np.arange(1, ids + 1, dtype=np.float64) ** -skew
+        id_codes = rng.choice(ids, size=rows, p=weights / weights.sum())
+    else:
+        id_codes = rng.integers(0, ids, rows)
+    campaign_codes = rng.integers(0, campaigns, rows)
+    return id_codes, campaign_codes
+
+
+def records(id_codes, campaign_codes):
+    """ヘッダー以降の行を順に返す"""
+    for id_code, campaign_code in zip(id_codes.tolist(), campaign_codes.tolist()):
+        yield [
+            f"氏名{id_code}",
+            f"00Q{id_code:015d}",
+            f"{PREFIXES[campaign_code % len(PREFIXES)]}キャンペーン{campaign_code}",
+            STATUSES[campaign_code % len(STATUSES)]
+        ]
+
+
+def write_export(path, rows, ids, campaigns, skew=0.0, header_offset=0, encoding='utf-8',
+                 file_format='csv', seed=0):
+    """ヘッダー前に header_offset 行の前置きを持つ合成エクスポートを作成する"""
+    id_codes, campaign_codes = generate_rows(rows, ids, campaigns, skew, seed)
+    preamble = [[f"レポート前置き{i}"] for i in range(header_offset)]
+
+    if file_format == 'xlsx':
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet('レポート')
+        for values in preamble + [HEADER]:
+            worksheet.append(values)
+        for values in records(id_codes, campaign_codes):
+            worksheet.append(values)
+        workbook.save(path)
+    else:
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            writer = csv.writer(f)
+            writer.writerows(preamble + [HEADER])
+            writer.writerows(records(id_codes, campaign_codes))
+
+
+def add_arguments(parser):
+    """生成パラメータの引数を追加する（bench_pipeline.py と共通）"""
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--ids', type=int, default=100_000)
+    parser.add_argument('--campaigns', type=int, default=1_000)
+    parser.add_argument('--skew', type=float, default=0.0, help='IDあたりのキャンペーン数の偏り（0で一様）')
+    parser.add_argument('--header-offset', type=int, default=0, help='ヘッダー行の前の行数')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    add_arguments(parser)
+    parser.add_argument('--encoding', choices=['utf-8', 'cp932'], default='utf-8')
+    args = parser.parse_args()
+
+    file_format = 'xlsx' if args.path.lower().endswith('.xlsx') else 'csv'
+    write_export(
+        args.path, args.rows, args.ids, args.campaigns, args.skew, args.header_offset,
+        args.encoding, file_format, args.seed
+    )
+
+
+if __name__ == '__main__':
+    main()
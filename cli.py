@@ -0,0 +1,163 @@
+"""共起行列・キャンペーン名クリーニングのコマンドライン実行
+
+Webサーバーを起動せずに、ファイル・ディレクトリ・globで指定したエクスポートをまとめて処理し、
+結果を --output-dir に書き出す（夜間バッチなど）。複数ファイルはプロセスを分けて並行に処理する。
+app は引数を解析した後に読み込み、pandas などは処理で使うときに読み込むため、--help はすぐに返る。
+
+    python cli.py cooccurrence exports/ --output-dir results --jobs 4 --output-format parquet
+    python cli.py cooccurrence 'exports/*.csv' --merge --metrics jaccard lift
+    python cli.py campaign exports/*.xlsx --output-dir cleaned
+
+出力ファイルのパスを1行ずつ標準出力に表示し、失敗したファイルがあれば終了コード1で終了する。
+結果キャッシュと照会用インデックスは出力先の _cache / _index に保存される。
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+INPUT_EXTENSIONS = ('.csv', '.xlsx')
+METRICS = ('jaccard', 'lift', 'pmi', 'cosine')
+
+
+def expand_inputs(patterns):
+    """ファイル・ディレクトリ・globパターンを処理対象のファイル一覧にする（重複は除く）"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [
+                os.path.join(pattern, name) for name in sorted(os.listdir(pattern))
+                if name.lower().endswith(INPUT_EXTENSIONS)
+            ]
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if not os.path.isfile(path):
+                raise ValueError(f"ファイルが見つかりません: {path}")
+            if not path.lower().endswith(INPUT_EXTENSIONS):
+                raise ValueError(f"対応していないファイル形式です: {path}")
+        paths.extend(matches)
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def configure(output_dir, verbose):
+    """app を読み込み、出力先とログレベルを設定する（ワーカープロセスでも実行する）"""
+    import app as application
+    os.makedirs(output_dir, exist_ok=True)
+    application.app.config['OUTPUT_FOLDER'] = output_dir
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+    return application
+
+
+def process_file(command, options, path):
+    """1ファイルを処理し、(入力パス, 出力ファイル名の一覧, エラー) を返す"""
+    import app as application
+    try:
+        if command == 'cooccurrence':
+            result = application.process_cooccurrence_file(path, os.path.basename(path), **options)
+        else:
+            result = application.process_campaign_file(path, os.path.basename(path))
+    except Exception as e:
+        return path, [], str(e)
+    return path, result if isinstance(result, list) else [result], None
+
+
+def cooccurrence_options(application, args):
+    """引数を /process_cooccurrence と同じ検証にかけ、処理関数の引数にする"""
+    return application.parse_cooccurrence_options({
+        'streaming': args.streaming,
+        'workers': args.count_workers,
+        'clean_campaigns': args.clean_campaigns,
+        'output_mode': args.output_mode,
+        'output_format': args.output_format,
+        'min_count': args.min_count,
+        'top_k': args.top_k,
+        'metrics': args.metrics
+    })
+
+
+def run(args):
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        raise ValueError("処理するファイルがありません")
+    output_dir = os.path.abspath(args.output_dir)
+    application = configure(output_dir, args.verbose)
+
+    options = {}
+    if args.command == 'cooccurrence':
+        options = cooccurrence_options(application, args)
+
+    if args.command == 'cooccurrence' and args.merge:
+        # 統合モードは全ファイルで1つの結果になるため、このプロセスで実行する
+        options.pop('streaming')
+        try:
+            result = application.process_merged_cooccurrence_files(
+                paths, [os.path.basename(path) for path in paths], **options
+            )
+            results = [(', '.join(paths), result if isinstance(result, list) else [result], None)]
+        except Exception as e:
+            results = [(', '.join(paths), [], str(e))]
+    else:
+        jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(paths)))
+        if jobs == 1:
+            results = [process_file(args.command, options, path) for path in paths]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=configure, initargs=(output_dir, args.verbose)
+            ) as pool:
+                results = list(pool.map(process_file, [args.command] * len(paths), [options] * len(paths), paths))
+
+    failed = 0
+    for path, outputs, error in results:
+        if error:
+            failed += 1
+            print(f"失敗: {path}: {error}", file=sys.stderr)
+        for output in outputs:
+            print(os.path.join(output_dir, output))
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser):
+        subparser.add_argument('inputs', nargs='+', help='入力ファイル・ディレクトリ・globパターン（csv / xlsx）')
+        subparser.add_argument('-o', '--output-dir', default='.', help='出力先ディレクトリ（既定: カレントディレクトリ）')
+        subparser.add_argument('-j', '--jobs', type=int, help='並行して処理するファイル数（既定: CPU数）')
+        subparser.add_argument('-v', '--verbose', action='store_true', help='処理ログを表示する')
+
+    cooccurrence = subparsers.add_parser('cooccurrence', help='共起行列を作成する')
+    add_common(cooccurrence)
+    cooccurrence.add_argument('--merge', action='store_true', help='全ファイルをIDで統合して1つの共起行列にする')
+    cooccurrence.add_argument('--clean-campaigns', action='store_true', help='キャンペーン名を整形してから集計する')
+    cooccurrence.add_argument('--output-mode', choices=['matrix', 'pairs'], default='matrix')
+    cooccurrence.add_argument('--output-format', choices=['csv', 'xlsx', 'parquet', 'arrow', 'npz'],
+                              help='出力形式（既定: 入力と同じ、pairs の場合は csv）')
+    cooccurrence.add_argument('--min-count', type=int, help='pairs で出力する最小の共起回数')
+    cooccurrence.add_argument('--top-k', type=int, help='pairs で出力する上位件数')
+    cooccurrence.add_argument('--metrics', nargs='+', choices=METRICS, default=[], help='出力する関連度指標')
+    cooccurrence.add_argument('--streaming', action=argparse.BooleanOptionalAction, default=None,
+                              help='CSVをチャンクごとに読み込む（既定: ファイルサイズで判断）')
+    cooccurrence.add_argument('--count-workers', type=int, help='1ファイルの共起回数を計算するプロセス数')
+
+    campaign = subparsers.add_parser('campaign', help='キャンペーン名をクリーニングする')
+    add_common(campaign)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return run(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,7 +10,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const processButton = document.getElementById('process-button');
     const processSection = document.getElementById('process-section');
     const processStatus = document.getElementById('process-status');
+    const processProgress = document.getElementById('process-progress');
+    const processProgressBar = processProgress?.querySelector('.progress-bar');
     const dropZone = document.querySelector('.custom-file-input');
+    const cleanCampaignsInput = document.getElementById('clean-campaigns');
+    const outputFormatInput = document.getElementById('output-format');
+    const mergeFilesInput = document.getElementById('merge-files');
     let uploadedFiles = [];
 
     // ユーティリティ関数
@@ -120,6 +125,75 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // 分割アップロード（チャンクごとに送信し、失敗した場合は受信済みの位置から再開する）
+    const UPLOAD_CHUNK_RETRIES = 5;
+    const UPLOAD_RETRY_DELAY = 2000;
+
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+    const requestJson = async (url, options = {}) => {
+        const response = await fetch(url, { credentials: 'include', ...options });
+        const data = await response.json().catch(() => ({}));
+        return { ok: response.ok, status: response.status, data };
+    };
+
+    const uploadFileInChunks = async (file, onProgress) => {
+        // ページを再読み込みしても同じファイルなら途中から再開できるよう、アップロードIDを保存する
+        const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        let session = null;
+        const savedId = localStorage.getItem(resumeKey);
+        if (savedId) {
+            const status = await requestJson(`/uploads/${savedId}`);
+            if (status.ok && status.data.success) session = status.data;
+        }
+        if (!session) {
+            const init = await requestJson('/uploads', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            if (!init.ok || !init.data.success) {
+                throw new Error(init.data.error || `サーバーエラー: ${init.status}`);
+            }
+            session = init.data;
+            localStorage.setItem(resumeKey, session.upload_id);
+        }
+
+        let offset = session.received;
+        let failures = 0;
+        onProgress(offset);
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + session.chunk_size);
+            try {
+                const result = await requestJson(`/uploads/${session.upload_id}/chunks?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+                if (result.data.received !== undefined) offset = result.data.received;
+                if (!result.ok && result.status !== 409) {
+                    throw new Error(result.data.error || `サーバーエラー: ${result.status}`);
+                }
+                failures = 0;
+            } catch (error) {
+                // 接続が切れた場合はサーバーの受信済みバイト数を確認して再送する
+                failures += 1;
+                if (failures > UPLOAD_CHUNK_RETRIES) throw error;
+                await sleep(UPLOAD_RETRY_DELAY);
+                const status = await requestJson(`/uploads/${session.upload_id}`).catch(() => null);
+                if (status?.ok) offset = status.data.received;
+            }
+            onProgress(offset);
+        }
+
+        const finalize = await requestJson(`/uploads/${session.upload_id}/finalize`, { method: 'POST' });
+        if (!finalize.ok || !finalize.data.success) {
+            throw new Error(finalize.data.error || `サーバーエラー: ${finalize.status}`);
+        }
+        localStorage.removeItem(resumeKey);
+        return finalize.data.files[0];
+    };
+
     // ファイルアップロード処理
     const uploadFiles = async (files) => {
         if (!files || files.length === 0) {
@@ -141,42 +215,93 @@ document.addEventListener('DOMContentLoaded', () => {
         if (progressContainer) progressContainer.style.display = 'block';
         if (processSection) processSection.style.display = 'none';
 
-        const formData = new FormData();
-        Array.from(files).forEach(file => formData.append('files[]', file));
+        const fileArray = Array.from(files);
+        const totalBytes = fileArray.reduce((sum, file) => sum + file.size, 0);
+        let doneBytes = 0;
+        const names = [];
 
         try {
-            const xhr = new XMLHttpRequest();
-            xhr.open('POST', '/upload', true);
+            for (const file of fileArray) {
+                const name = await uploadFileInChunks(file, (received) => {
+                    updateProgress(totalBytes ? ((doneBytes + received) / totalBytes) * 100 : 100);
+                });
+                doneBytes += file.size;
+                names.push(name);
+            }
+            uploadedFiles = names;
+            completeUpload();
+        } catch (error) {
+            showError(error.message || 'アップロードに失敗しました');
+        }
+    };
 
-            xhr.upload.onprogress = (e) => {
-                if (e.lengthComputable) {
-                    updateProgress((e.loaded / e.total) * 100);
-                }
-            };
-
-            xhr.onload = () => {
-                if (xhr.status === 200) {
-                    try {
-                        const response = JSON.parse(xhr.responseText);
-                        if (response.success) {
-                            uploadedFiles = response.files;
-                            completeUpload();
-                        } else {
-                            showError(response.error || 'アップロードに失敗しました');
-                        }
-                    } catch (e) {
-                        showError('レスポンスの解析に失敗しました');
-                    }
-                } else {
-                    showError(`サーバーエラー: ${xhr.status}`);
-                }
-            };
+    // 処理段階ごとの進捗率（counting は処理済みIDの割合で補間）
+    const STAGE_PROGRESS = {
+        header_detected: 10,
+        parsed: 30,
+        counting: 30,
+        counted: 70,
+        cleaned: 70,
+        assembled: 75,
+        write_started: 80,
+        write_finished: 100
+    };
+    const fileProgress = {};
+
+    const updateProcessProgress = (event) => {
+        let percent = STAGE_PROGRESS[event.stage] ?? 0;
+        if (event.stage === 'counting' && event.groups_total) {
+            percent += 40 * event.groups_done / event.groups_total;
+        }
+        fileProgress[event.filename] = percent;
+
+        const values = uploadedFiles.map(name => fileProgress[name] || 0);
+        const total = values.reduce((sum, value) => sum + value, 0) / (values.length || 1);
+        if (processProgress) processProgress.style.display = 'block';
+        if (processProgressBar) {
+            processProgressBar.style.width = `${Math.round(total)}%`;
+            processProgressBar.textContent = `${Math.round(total)}%`;
+        }
+    };
 
-            xhr.onerror = () => showError('ネットワークエラーが発生しました');
-            xhr.send(formData);
+    // Socket.IO クライアント（static/js/socket.io.min.js）でジョブの進捗イベントを受信する
+    const subscribeJobProgress = (jobId, onEvent) => {
+        if (typeof window.io !== 'function') return null;
+        const socket = window.io();
+        // 再接続した場合もジョブのルームに参加し直す
+        socket.on('connect', () => socket.emit('subscribe', { job_id: jobId }));
+        socket.on('job_progress', (data) => onEvent('job_progress', data));
+        socket.on('job_status', (data) => onEvent('job_status', data));
+        socket.on('connect_error', () => console.warn('進捗通知に接続できませんでした。ポーリングで確認します。'));
+        return socket;
+    };
 
-        } catch (error) {
-            showError(`エラーが発生しました: ${error.message}`);
+    // ジョブの進捗をポーリング
+    const JOB_POLL_INTERVAL = 1000;
+
+    const updateJobStatus = (job) => {
+        if (!processStatus) return;
+        const done = job.files.filter(file => ['completed', 'failed'].includes(file.status)).length;
+        const rows = job.files.reduce((sum, file) => sum + (file.rows || 0), 0);
+        processStatus.textContent = `処理中です... (${done}/${job.files.length} ファイル完了, ${rows.toLocaleString()} 行, ${job.elapsed.toFixed(1)} 秒)`;
+    };
+
+    const waitForJob = async (statusUrl) => {
+        while (true) {
+            const response = await fetch(statusUrl, {
+                headers: { 'Accept': 'application/json' },
+                credentials: 'include'
+            });
+            const job = await response.json();
+            if (!response.ok || !job.success) {
+                throw new Error(job.error || `サーバーエラー (${response.status})`);
+            }
+
+            updateJobStatus(job);
+            if (job.status === 'completed' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
         }
     };
 
@@ -202,7 +327,13 @@ document.addEventListener('DOMContentLoaded', () => {
                     'Accept': 'application/json'
                 },
                 credentials: 'include',
-                body: JSON.stringify({ files: uploadedFiles })
+                body: JSON.stringify({
+                    files: uploadedFiles,
+                    clean_campaigns: Boolean(cleanCampaignsInput?.checked),
+                    merge: Boolean(mergeFilesInput?.checked),
+                    output_format: outputFormatInput?.value || null,
+                    metrics: Array.from(document.querySelectorAll('.metric-option:checked'), input => input.value)
+                })
             });
 
                         // レスポンスの内容をログ出力（デバッグ用）
@@ -221,12 +352,25 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(data.error || `サーバーエラー (${response.status})`);
             }
 
-            if (data.success && data.redirect) {
-                window.location.href = data.redirect;
-            } else {
+            if (!data.success || !data.job_id) {
                 throw new Error(data.error || '処理に失敗しました');
             }
 
+            // 進捗イベントを受信しつつ、ジョブの完了を待ってから完了ページへ移動
+            const socket = subscribeJobProgress(data.job_id, (name, event) => {
+                if (name === 'job_progress') updateProcessProgress(event);
+            });
+            let job;
+            try {
+                job = await waitForJob(data.status_url);
+            } finally {
+                socket?.close();
+            }
+            if (job.status === 'failed') {
+                throw new Error((job.errors && job.errors.join('\n')) || '全てのファイルの処理に失敗しました');
+            }
+            window.location.href = data.redirect;
+
         } catch (error) {
             console.error('Processing error:', error);
             showError(error.message || 'ファイルの処理中にエラーが発生しました');
@@ -236,6 +380,9 @@ document.addEventListener('DOMContentLoaded', () => {
             if (processStatus) {
                 processStatus.style.display = 'none';
             }
+            if (processProgress) {
+                processProgress.style.display = 'none';
+            }
             if (processButton?.querySelector('.button-content')) {
                 processButton.querySelector('.button-content').innerHTML = `
                     <span class="button-text">🚀 処理を開始</span>
@@ -244,6 +391,40 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // 完了ページの共起行列プレビュー：キャンペーンの共起先をサーバーに照会して表示する
+    const showMatrixRow = async (preview, campaign) => {
+        const status = preview.querySelector('.preview-status');
+        const table = preview.querySelector('.preview-row');
+        const body = table.querySelector('tbody');
+        try {
+            const params = new URLSearchParams({ campaign, limit: 20 });
+            const { ok, data: result } = await requestJson(`${preview.dataset.rowUrl}?${params}`);
+            if (!ok || !result.success) throw new Error(result.error || '照会に失敗しました');
+            body.replaceChildren(...result.items.map(item => {
+                const row = document.createElement('tr');
+                for (const value of [item.campaign, item.count]) {
+                    const cell = document.createElement('td');
+                    cell.textContent = value;
+                    row.appendChild(cell);
+                }
+                return row;
+            }));
+            status.textContent = `${result.campaign}: ID ${result.support}件, 共起先 ${result.total}件`;
+            table.style.display = result.items.length ? 'table' : 'none';
+        } catch (error) {
+            status.textContent = error.message;
+            table.style.display = 'none';
+        }
+    };
+
+    document.querySelectorAll('.matrix-preview').forEach(preview => {
+        preview.querySelector('.preview-form')?.addEventListener('submit', (e) => {
+            e.preventDefault();
+            const campaign = preview.querySelector('.preview-campaign').value.trim();
+            if (campaign) showMatrixRow(preview, campaign);
+        });
+    });
+
     // イベントリスナー
     fileInput?.addEventListener('change', (e) => {
         const selectedFiles = e.target.files;
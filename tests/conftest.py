@@ -0,0 +1,14 @@
+"""テスト共通設定
+
+app の読み込み時に成果物・メモ・状態の保存先が作られるため、先に一時ディレクトリへ向ける。
+"""
+import os
+import sys
+import tempfile
+
+_root = tempfile.mkdtemp(prefix='co_occurrence_test_')
+os.environ.setdefault('ARTIFACT_FOLDER', os.path.join(_root, 'artifacts'))
+os.environ.setdefault('CAMPAIGN_MEMO_PATH', os.path.join(_root, 'campaign_memo.json'))
+os.environ.setdefault('STATE_FOLDER', os.path.join(_root, 'states'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
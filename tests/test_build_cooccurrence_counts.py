@@ -0,0 +1,84 @@
+"""build_cooccurrence_counts が従来の組み合わせループと同じ共起行列を返すことの確認"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def reference_cooccurrence_matrix(df):
+    """従来の process_cooccurrence_file の集計（IDごとのユニークなキャンペーンの組を数える）"""
+    co_occurrence_counts = {}
+    for _, group in df.groupby("見込客/担当者ID18"):
+        campaign_names = group["キャンペーン名"].unique()
+        if len(campaign_names) >= 2:
+            for i in range(len(campaign_names)):
+                for j in range(i + 1, len(campaign_names)):
+                    camp1, camp2 = campaign_names[i], campaign_names[j]
+                    pair = tuple(sorted([camp1, camp2]))
+                    co_occurrence_counts[pair] = co_occurrence_counts.get(pair, 0) + 1
+
+    unique_campaigns = sorted(df["キャンペーン名"].unique())
+    co_occurrence_matrix = pd.DataFrame(0, index=unique_campaigns, columns=unique_campaigns)
+    for (camp1, camp2), count in co_occurrence_counts.items():
+        co_occurrence_matrix.at[camp1, camp2] = count
+        co_occurrence_matrix.at[camp2, camp1] = count
+    return co_occurrence_matrix
+
+
+def random_export(seed, n_rows=2000, n_ids=300, n_campaigns=25):
+    """重複行を含むID×キャンペーンのランダムなエクスポート"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "見込客/担当者ID18": [f"00Q{code:015d}" for code in rng.integers(0, n_ids, n_rows)],
+        "キャンペーン名": [f"{code:03d}/キャンペーン{code}" for code in rng.integers(0, n_campaigns, n_rows)],
+    })
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matches_reference_loop(seed):
+    df = random_export(seed)
+    expected = reference_cooccurrence_matrix(df)
+
+    counts, unique_campaigns, support, total_ids = app.build_cooccurrence_counts(
+        df["見込客/担当者ID18"], df["キャンペーン名"]
+    )
+    actual = app.to_cooccurrence_frame(counts, unique_campaigns)
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    assert total_ids == df["見込客/担当者ID18"].nunique()
+    assert list(np.asarray(support).ravel()) == [
+        df.loc[df["キャンペーン名"] == name, "見込客/担当者ID18"].nunique() for name in unique_campaigns
+    ]
+
+
+def test_single_campaign_ids_and_duplicates():
+    df = pd.DataFrame({
+        "見込客/担当者ID18": ["a", "a", "a", "b", "c", "c"],
+        "キャンペーン名": ["X", "X", "Y", "X", "Z", "Z"],
+    })
+    counts, unique_campaigns, _, _ = app.build_cooccurrence_counts(
+        df["見込客/担当者ID18"], df["キャンペーン名"]
+    )
+    pd.testing.assert_frame_equal(
+        app.to_cooccurrence_frame(counts, unique_campaigns),
+        reference_cooccurrence_matrix(df),
+        check_dtype=False
+    )
+
+
+def test_blank_campaign_cells_are_skipped():
+    df = pd.DataFrame({
+        "見込客/担当者ID18": ["a", "a", "a", "b", "b", "c"],
+        "キャンペーン名": ["X", None, "Y", "X", np.nan, "Y"],
+    })
+    counts, unique_campaigns, support, total_ids = app.build_cooccurrence_counts(
+        df["見込客/担当者ID18"], df["キャンペーン名"]
+    )
+    assert unique_campaigns == ["X", "Y"]
+    pd.testing.assert_frame_equal(
+        app.to_cooccurrence_frame(counts, unique_campaigns),
+        reference_cooccurrence_matrix(df.dropna()),
+        check_dtype=False
+    )
+    assert list(np.asarray(support).ravel()) == [2, 2]
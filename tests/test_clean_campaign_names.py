@@ -0,0 +1,75 @@
+"""clean_campaign_names が従来の5つの正規表現による clean_campaign_name と同じ結果を返すことの確認"""
+import re
+
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def reference_clean_campaign_name(campaign_name):
+    """従来の clean_campaign_name（5つのパターンを順に適用する）"""
+    if pd.isna(campaign_name):
+        return campaign_name
+
+    campaign_name = str(campaign_name)
+    patterns = [
+        r'^\d+[/／]',
+        r'^\d+\s*[/／]',
+        r'^[\d\s/／]+',
+        r'^[/／]+',
+        r'^\d+[/／]\d+[/／]',
+    ]
+
+    cleaned = campaign_name
+    for pattern in patterns:
+        cleaned = re.sub(pattern, '', cleaned)
+
+    cleaned = re.sub(r'^[/／]+', '', cleaned)
+    cleaned = cleaned.strip()
+
+    return cleaned
+
+
+CAMPAIGN_NAMES = [
+    '2024/春のセミナー',
+    '2024／春のセミナー',
+    '12 / 展示会',
+    '１２/全角数字は残す',
+    '2024/04/ウェビナー',
+    '//先頭スラッシュ',
+    '／／全角スラッシュ',
+    '  前後の空白  ',
+    '123',
+    '',
+    '名前/途中のスラッシュ',
+    '0001 0002／複合',
+    2024,
+    None,
+    np.nan,
+]
+
+
+def test_matches_reference_apply():
+    series = pd.Series(CAMPAIGN_NAMES * 3, dtype=object, name='キャンペーン名')
+    expected = series.apply(reference_clean_campaign_name)
+
+    pd.testing.assert_series_equal(app.clean_campaign_names(series), expected)
+
+
+def test_matches_reference_random_prefixes():
+    rng = np.random.default_rng(0)
+    alphabet = list('0123456789 /／') + ['キ', 'a', '\t']
+    values = [''.join(rng.choice(alphabet, rng.integers(0, 12))) for _ in range(2000)]
+    series = pd.Series(values, dtype=object)
+
+    pd.testing.assert_series_equal(
+        app.clean_campaign_names(series), series.apply(reference_clean_campaign_name)
+    )
+
+
+def test_single_value_function_matches_reference():
+    for value in CAMPAIGN_NAMES:
+        actual = app.clean_campaign_name(value)
+        expected = reference_clean_campaign_name(value)
+        assert actual == expected or (pd.isna(actual) and pd.isna(expected))
@@ -0,0 +1,46 @@
+"""差分マージ（DᵀX + XᵀD + DᵀD）が全体を集計し直した結果と一致することの確認"""
+import pandas as pd
+
+import app
+from test_build_cooccurrence_counts import random_export, reference_cooccurrence_matrix
+
+
+def merge(state, df):
+    return app.merge_cooccurrence_delta(state, df["見込客/担当者ID18"], df["キャンペーン名"])
+
+
+def state_frame(state):
+    return app.to_cooccurrence_frame(*app.state_cooccurrence_counts(state))
+
+
+def test_two_deltas_match_full_rebuild(tmp_path):
+    path = str(tmp_path / 'state.npz')
+    first = random_export(0, n_rows=1500)
+    # 2つ目の差分は既存のIDと既存の (ID, キャンペーン) の組を含む
+    second = pd.concat([random_export(1, n_rows=1500), first.sample(200, random_state=0)], ignore_index=True)
+
+    state = app.load_cooccurrence_state(path)
+    merge(state, first)
+    app.save_cooccurrence_state(path, state)
+    state = app.load_cooccurrence_state(path)
+    merge(state, second)
+
+    pd.testing.assert_frame_equal(
+        state_frame(state),
+        reference_cooccurrence_matrix(pd.concat([first, second], ignore_index=True)),
+        check_dtype=False
+    )
+
+
+def test_remerging_the_same_delta_changes_nothing(tmp_path):
+    delta = random_export(2, n_rows=1500)
+    state = app.load_cooccurrence_state(str(tmp_path / 'state.npz'))
+    merge(state, delta)
+    before = state_frame(state)
+
+    stats = merge(state, delta)
+
+    assert stats['new_memberships'] == 0
+    assert stats['new_pairs'] == 0
+    pd.testing.assert_frame_equal(state_frame(state), before)
+    pd.testing.assert_frame_equal(before, reference_cooccurrence_matrix(delta), check_dtype=False)
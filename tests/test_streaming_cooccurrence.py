@@ -0,0 +1,48 @@
+"""チャンクごとに読み込む共起回数の集計が、全体を読み込んだ場合と同じ結果になることの確認"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def random_campaigns(kind, rng, n_rows):
+    if kind == 'numeric':
+        return rng.integers(1, 200, n_rows) * 7
+    if kind == 'numeric_blank':
+        values = (rng.integers(1, 200, n_rows) * 7).astype(object)
+        values[rng.random(n_rows) < 0.05] = None
+        return values
+    if kind == 'zero_padded':
+        return [f"{code:03d}" if code % 2 else str(code) for code in rng.integers(1, 60, n_rows)]
+    return [f"{code:03d}/キャンペーン{code}" for code in rng.integers(0, 40, n_rows)]
+
+
+@pytest.mark.parametrize('clean_campaigns', [False, True])
+@pytest.mark.parametrize('kind', ['numeric', 'numeric_blank', 'zero_padded', 'text'])
+def test_streaming_matches_in_memory(tmp_path, kind, clean_campaigns):
+    rng = np.random.default_rng(0)
+    n_rows = 3000
+    filepath = tmp_path / 'export.csv'
+    pd.DataFrame({
+        "見込客/担当者ID18": [f"00Q{code:015d}" for code in rng.integers(0, 400, n_rows)],
+        "キャンペーン名": random_campaigns(kind, rng, n_rows),
+    }).to_csv(filepath, index=False, encoding='utf-8-sig')
+
+    df = pd.read_csv(filepath, encoding='utf-8-sig')
+    if clean_campaigns:
+        df["キャンペーン名"] = app.clean_campaign_names(df["キャンペーン名"])
+    expected_counts, expected_labels, expected_support, expected_total = app.build_cooccurrence_counts(
+        df["見込客/担当者ID18"], df["キャンペーン名"]
+    )
+    counts, labels, support, total_ids = app.stream_cooccurrence_counts(
+        str(filepath), 'csv', chunk_rows=700, clean_campaigns=clean_campaigns
+    )
+
+    assert labels == expected_labels
+    pd.testing.assert_frame_equal(
+        app.to_cooccurrence_frame(counts, labels),
+        app.to_cooccurrence_frame(expected_counts, expected_labels)
+    )
+    assert list(support) == list(expected_support)
+    assert total_ids == expected_total